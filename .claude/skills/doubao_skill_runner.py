@@ -10,20 +10,27 @@ script will create the Markdown outputs beside that document.
 from __future__ import annotations
 
 import argparse
+import asyncio
+import hashlib
+import importlib.util
 import os
+import random
 import sys
 from dataclasses import dataclass
+from functools import cached_property
 from pathlib import Path
-from turtle import dot
-from typing import Dict, Iterable, List
-from dotenv import load_dotenv
-from openai import OpenAI
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 
 BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
 DEFAULT_MODEL = "doubao-seed-1-6-251015"
 SCRIPT_DIR = Path(__file__).resolve().parent
-ARK_API_KEY = load_dotenv()
+MAX_ATTEMPTS = 5
+RETRY_MAX_DELAY = 30.0
+CACHE_DIR = SCRIPT_DIR / ".cache"
 
 SCRIPT_SYSTEM_PROMPT = """您是“training-script-generator”技能，一名擅长将实训任务文档转换成可落地能力训练剧本配置的专家。严格基于文档内容输出 Markdown，遵循以下要点：
 1. 绝不编造文档中不存在的信息。
@@ -42,13 +49,23 @@ DIALOGUE_SYSTEM_PROMPT = """您是“training-dialogue-simulator”技能，一
 """
 
 
-@dataclass
+@dataclass(eq=False)
 class SkillConfig:
+    key: str
     name: str
     system_prompt: str
     output_filename: str
     user_prompt_template: str
-    instruction_text: str
+    instruction_paths: List[List[str]]
+
+    @cached_property
+    def instruction_text(self) -> str:
+        # Only read the skill documents once a run actually needs them.
+        return _cached_instructions(self.key, self.instruction_paths)
+
+    @cached_property
+    def full_system_prompt(self) -> str:
+        return f"{self.system_prompt}\n\n# 技能文档\n{self.instruction_text}"
 
 
 SCRIPT_USER_TEMPLATE = """你将获得一份实训任务 Markdown 文档，请根据该文档生成完整的训练剧本配置，确保内容覆盖 instructions 中的全部要素。
@@ -103,31 +120,66 @@ def combine_instructions(paths: List[List[str]]) -> str:
     return "\n\n".join(chunks)
 
 
+def _cached_instructions(skill_key: str, paths: List[List[str]]) -> str:
+    """Return combined instructions, reusing a blob cached under ``.cache``.
+
+    The cache key hashes each instruction path with its mtime, so editing any
+    SKILL/reference/examples file produces a fresh blob on the next run; the
+    superseded blobs for the same skill are pruned when the new one is written.
+    """
+    try:
+        fingerprint = b"|".join(
+            str((parts, (SCRIPT_DIR / Path(*parts)).stat().st_mtime_ns)).encode("utf-8")
+            for parts in paths
+        )
+    except FileNotFoundError:
+        # Let combine_instructions raise its descriptive error.
+        return combine_instructions(paths)
+
+    digest = hashlib.blake2b(fingerprint, digest_size=16).hexdigest()
+    cache_path = CACHE_DIR / f"{skill_key}-{digest}.md"
+    if cache_path.exists():
+        return cache_path.read_bytes().decode("utf-8")
+
+    text = combine_instructions(paths)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(text.encode("utf-8"))
+        os.replace(tmp_path, cache_path)
+        # Keep a single blob per skill: drop blobs for older mtimes.
+        for stale in CACHE_DIR.glob(f"{skill_key}-*.md"):
+            if stale != cache_path:
+                stale.unlink(missing_ok=True)
+    except OSError:
+        # Cache is best-effort; a read-only checkout still works.
+        pass
+    return text
+
+
 SKILLS: Dict[str, SkillConfig] = {
     "script": SkillConfig(
+        key="script",
         name="训练剧本配置",
         system_prompt=SCRIPT_SYSTEM_PROMPT,
         output_filename="训练剧本配置.md",
         user_prompt_template=SCRIPT_USER_TEMPLATE,
-        instruction_text=combine_instructions(
-            [
-                ["training-script-generator", "SKILL.md"],
-                ["training-script-generator", "reference.md"],
-                ["training-script-generator", "examples.md"],
-            ]
-        ),
+        instruction_paths=[
+            ["training-script-generator", "SKILL.md"],
+            ["training-script-generator", "reference.md"],
+            ["training-script-generator", "examples.md"],
+        ],
     ),
     "dialogue": SkillConfig(
+        key="dialogue",
         name="对话流程模拟",
         system_prompt=DIALOGUE_SYSTEM_PROMPT,
         output_filename="对话流程模拟.md",
         user_prompt_template=DIALOGUE_USER_TEMPLATE,
-        instruction_text=combine_instructions(
-            [
-                ["training-dialogue-simulator", "SKILL.md"],
-                ["training-dialogue-simulator", "examples.md"],
-            ]
-        ),
+        instruction_paths=[
+            ["training-dialogue-simulator", "SKILL.md"],
+            ["training-dialogue-simulator", "examples.md"],
+        ],
     ),
 }
 
@@ -137,9 +189,11 @@ def parse_args(argv: Iterable[str]) -> argparse.Namespace:
         description="Use Doubao to run training-script-generator and training-dialogue-simulator skills",
     )
     parser.add_argument(
-        "document",
+        "documents",
+        nargs="+",
         type=Path,
-        help="Path to the input training task Markdown document",
+        metavar="document",
+        help="Path(s) to the input training task Markdown document(s)",
     )
     parser.add_argument(
         "--skills",
@@ -170,10 +224,27 @@ def parse_args(argv: Iterable[str]) -> argparse.Namespace:
         default=0.9,
         help="Top-p value for nucleus sampling",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of documents processed at the same time (default: 4)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate outputs even if they already exist",
+    )
     return parser.parse_args(list(argv))
 
 
 def ensure_api_key(value: str | None) -> str:
+    if not value:
+        # Only parse .env when neither --api-key nor the environment provide one.
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        value = os.getenv("ARK_API_KEY")
     if not value:
         raise SystemExit(
             "Missing API key. Provide --api-key or export ARK_API_KEY before running this script."
@@ -184,15 +255,27 @@ def ensure_api_key(value: str | None) -> str:
 def read_document(path: Path) -> str:
     if not path.exists():
         raise SystemExit(f"Document not found: {path}")
-    return path.read_text(encoding="utf-8")
+    # Skip read_text's newline translation; the prompts embed the text verbatim.
+    return path.read_bytes().decode("utf-8")
+
 
+def create_client(api_key: str) -> AsyncOpenAI:
+    # Imported here so `--help` and argument errors don't pay for the SDK.
+    import httpx
+    from openai import AsyncOpenAI
 
-def create_client(api_key: str) -> OpenAI:
-    return OpenAI(base_url=BASE_URL, api_key=api_key)
+    # One pooled connection set for every document/skill; HTTP/2 lets the
+    # concurrent completions share a single TLS session when h2 is installed.
+    http_client = httpx.AsyncClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        timeout=httpx.Timeout(600.0, connect=10.0),
+    )
+    return AsyncOpenAI(base_url=BASE_URL, api_key=api_key, http_client=http_client)
 
 
-def call_skill(
-    client: OpenAI,
+async def call_skill(
+    client: AsyncOpenAI,
     *,
     config: SkillConfig,
     doc_text: str,
@@ -201,65 +284,177 @@ def call_skill(
     temperature: float,
     top_p: float,
 ) -> str:
+    from openai import APIConnectionError, APITimeoutError, RateLimitError
+
     task_name = doc_path.stem
     user_prompt = config.user_prompt_template.format(
         task_name=task_name,
         doc_path=str(doc_path),
         doc_text=doc_text,
     )
-    full_system_prompt = (
-        f"{config.system_prompt}\n\n# 技能文档\n{config.instruction_text}"
-    )
-    response = client.chat.completions.create(
+    attempt = 1
+    while True:
+        try:
+            return await _stream_completion(
+                client,
+                config=config,
+                user_prompt=user_prompt,
+                model=model,
+                temperature=temperature,
+                top_p=top_p,
+            )
+        except (RateLimitError, APIConnectionError, APITimeoutError) as exc:
+            if attempt >= MAX_ATTEMPTS:
+                raise
+            # Exponential backoff with jitter so parallel skills don't retry in lockstep.
+            delay = min(RETRY_MAX_DELAY, 2 ** (attempt - 1)) + random.uniform(0, 1)
+            print(
+                f"\n{config.name} 请求失败({type(exc).__name__})，{delay:.1f}s 后第 {attempt + 1} 次尝试",
+                file=sys.stderr,
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+async def _stream_completion(
+    client: AsyncOpenAI,
+    *,
+    config: SkillConfig,
+    user_prompt: str,
+    model: str,
+    temperature: float,
+    top_p: float,
+) -> str:
+    stream = await client.chat.completions.create(
         model=model,
         temperature=temperature,
         top_p=top_p,
         messages=[
-            {"role": "system", "content": full_system_prompt},
+            {"role": "system", "content": config.full_system_prompt},
             {"role": "user", "content": user_prompt},
         ],
+        stream=True,
     )
-    message = response.choices[0].message
-    if message is None or message.content is None:
+    chunks: List[str] = []
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            chunks.append(delta)
+            sys.stderr.write(".")
+            sys.stderr.flush()
+    if not chunks:
         raise RuntimeError("Doubao returned an empty response")
-    return message.content
+    sys.stderr.write(f"\n{config.name} 生成完毕\n")
+    return "".join(chunks)
+
+
+def output_path_for(doc_path: Path, filename: str) -> Path:
+    return doc_path.parent / doc_path.stem / filename
 
 
 def write_output(doc_path: Path, filename: str, content: str) -> Path:
-    target_dir = doc_path.parent / doc_path.stem
-    target_dir.mkdir(parents=True, exist_ok=True)
-    target_path = target_dir / filename
+    target_path = output_path_for(doc_path, filename)
+    target_path.parent.mkdir(parents=True, exist_ok=True)
     target_path.write_text(content, encoding="utf-8")
     return target_path
 
 
-def main(argv: Iterable[str]) -> int:
-    args = parse_args(argv)
-    api_key = ensure_api_key(args.api_key)
-    doc_text = read_document(args.document)
-    client = create_client(api_key)
+async def run_skills_for_doc(
+    client: AsyncOpenAI,
+    args: argparse.Namespace,
+    doc_path: Path,
+    doc_text: str,
+) -> Tuple[List[str], bool]:
+    """Run the selected skills for one document.
 
+    Each skill writes its output as soon as it finishes, so a failing skill
+    never discards another skill's completed generation. Returns the summary
+    lines and whether any skill failed.
+    """
     outputs: List[str] = []
+    configs: List[SkillConfig] = []
     for skill_key in args.skills:
         config = SKILLS[skill_key]
-        print(f"Running {skill_key} skill for {args.document} …", file=sys.stderr)
-        content = call_skill(
+        target_path = output_path_for(doc_path, config.output_filename)
+        if not args.force and target_path.exists() and target_path.stat().st_size > 0:
+            print(f"Skipping {skill_key} skill for {doc_path} (cached, use --force to regenerate)", file=sys.stderr)
+            outputs.append(f"{config.name}: {target_path} (cached)")
+            continue
+        print(f"Running {skill_key} skill for {doc_path} …", file=sys.stderr)
+        configs.append(config)
+
+    async def run_skill(config: SkillConfig) -> Path:
+        content = await call_skill(
             client,
             config=config,
             doc_text=doc_text,
-            doc_path=args.document,
+            doc_path=doc_path,
             model=args.model,
             temperature=args.temperature,
             top_p=args.top_p,
         )
-        output_path = write_output(args.document, config.output_filename, content)
-        outputs.append(f"{config.name}: {output_path}")
+        return write_output(doc_path, config.output_filename, content)
+
+    results = await asyncio.gather(
+        *(run_skill(config) for config in configs),
+        return_exceptions=True,
+    )
+
+    failed = False
+    for config, result in zip(configs, results):
+        if isinstance(result, Exception):
+            failed = True
+            print(f"{config.name} 生成失败 ({doc_path}): {type(result).__name__}: {result}", file=sys.stderr)
+            outputs.append(f"{config.name}: 失败 ({type(result).__name__})")
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            outputs.append(f"{config.name}: {result}")
+    return outputs, failed
+
+
+async def main_async(argv: Iterable[str]) -> int:
+    args = parse_args(argv)
+    if args.concurrency < 1:
+        raise SystemExit("--concurrency must be at least 1")
+    api_key = ensure_api_key(args.api_key)
+    doc_texts = {doc_path: read_document(doc_path) for doc_path in args.documents}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    # Closing the AsyncOpenAI client also closes the pooled httpx client.
+    async with create_client(api_key) as client:
+
+        async def run_one(doc_path: Path) -> Tuple[List[str], bool]:
+            async with semaphore:
+                return await run_skills_for_doc(client, args, doc_path, doc_texts[doc_path])
+
+        # One failing document must not cancel the ones still running.
+        results = await asyncio.gather(
+            *(run_one(doc_path) for doc_path in doc_texts),
+            return_exceptions=True,
+        )
 
     print("\n生成完成:")
-    for line in outputs:
-        print(f"- {line}")
+    any_failed = False
+    for doc_path, result in zip(doc_texts, results):
+        if isinstance(result, Exception):
+            any_failed = True
+            print(f"- ❌ {doc_path}: {type(result).__name__}: {result}")
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        outputs, failed = result
+        any_failed = any_failed or failed
+        for line in outputs:
+            print(f"- {line}")
+
+    return 1 if any_failed else 0
+
 
-    return 0
+def main(argv: Iterable[str]) -> int:
+    return asyncio.run(main_async(argv))
 
 
 if __name__ == "__main__":
@@ -4,15 +4,57 @@ Training Config Setup Generator
 生成训练基础配置和Doubao封面图
 """
 
+import asyncio
+import io
 import os
+import re
 import sys
 import json
-from datetime import datetime
+import random
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Dict, Tuple, Optional
-from openai import OpenAI
+from openai import APIConnectionError, APITimeoutError, OpenAI, RateLimitError
 from dotenv import load_dotenv
 
+try:
+    import orjson  # 可选：更快的 JSON 序列化
+except ImportError:
+    orjson = None
+
+# 封面图接口的重试策略：限流/网络错误时指数退避并加随机抖动
+MAX_ATTEMPTS = 5
+RETRY_MAX_DELAY = 30.0
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError)
+
+
+def _utc_timestamp() -> str:
+    """当前UTC时间，格式如 2025-01-01T08:00:00Z"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _retry_delay(attempt: int) -> float:
+    """第 attempt 次失败后的等待秒数"""
+    return min(RETRY_MAX_DELAY, 2 ** (attempt - 1)) + random.uniform(0, 1)
+
+
+# 第一个包含"任务目标"/"课程描述"的行（描述从下一行开始收集）
+_TASK_SECTION_RE = re.compile(r'任务目标|课程描述')
+
+# 关键词 → 封面图提示词模板（按优先级排列）
+_PROMPT_TEMPLATES = {
+    "离心泵": "工业化工厂，离心泵运行场景，技术人员在仔细检查泵的状态，高清现代化工业设备，蓝色和灰色调，工业气氛浓厚，精密检测仪器，16:9宽屏，电影级质感，光影细节丰富",
+    "汽蚀": "工业现场，泵的故障诊断场景，工程师手持诊断工具，高科技仪器，动态光线，深蓝色和银灰色调，紧张专业的工作氛围，16:9宽屏，科技感十足",
+    "精馏": "化学实验室，精馏装置运行中，液体流动通过冷凝管，蒸馏烧瓶加热，科学仪器精密排列，蓝白调，科技感强，专业教学环境，玻璃仪器闪烁反光，16:9宽屏，细节丰富",
+    "展馆": "现代科技展馆内部，宽敞明亮的展厅，各种创意展示品，参观者在互动体验，科技感强烈，现代建筑风格，柔和的照明，开放式空间，16:9宽屏，沉浸感十足",
+    "非暴力沟通": "温暖的协作工作室，两个人在进行深入沟通交流，放松的氛围，柔和的自然光线，绿植点缀，现代简约风格，友好和谐，16:9宽屏，人性化气氛",
+    "投资": "现代办公会议室，投资推介会场景，专业的演讲者，观众认真听讲，高档的会议设备，蓝色商务调，专业严谨的氛围，大屏幕显示，16:9宽屏，企业级质感",
+}
+_PROMPT_KEYWORD_PRIORITY = {keyword: i for i, keyword in enumerate(_PROMPT_TEMPLATES)}
+_PROMPT_KEYWORD_RE = re.compile("|".join(map(re.escape, _PROMPT_TEMPLATES)))
+
+
 class TrainingConfigSetup:
     """训练基础配置生成器"""
 
@@ -51,33 +93,29 @@ class TrainingConfigSetup:
         Returns:
             (任务名称, 任务描述)
         """
-        lines = md_content.split('\n')
-
         # 提取任务名称（从路径或文档标题）
         task_name = Path(doc_path).stem
         task_name = task_name.replace("实训任务文档", "").replace("实训任务-", "").strip()
         if task_name.startswith("-"):
             task_name = task_name[1:].strip()
 
-        # 提取任务描述
-        task_description = ""
-        in_task_section = False
+        # 提取任务描述："任务目标"或"课程描述"部分中的非列表文本，最多3行
         desc_lines = []
-
-        for i, line in enumerate(lines):
-            # 查找"任务目标"或"任务描述"部分
-            if "任务目标" in line or "课程描述" in line:
-                in_task_section = True
-                continue
-
-            if in_task_section:
-                # 如果遇到新的标题或分隔符，停止
-                if line.startswith("#") and "任务目标" not in line:
+        match = _TASK_SECTION_RE.search(md_content)
+        if match:
+            # 从关键词所在行的下一行开始逐行惰性读取，收集够3行即停止
+            buf = io.StringIO(md_content)
+            buf.seek(match.start())
+            buf.readline()
+            for line in buf:
+                # 再次遇到关键词行（如紧跟的"课程描述"标题）时跳过并继续收集
+                if "任务目标" in line or "课程描述" in line:
+                    continue
+                # 遇到新的标题，停止
+                if line.startswith("#"):
                     break
-
-                # 收集描述文本
                 line = line.strip()
-                if line and not line.startswith("-") and not line.startswith("*"):
+                if line and not line.startswith(("-", "*")):
                     desc_lines.append(line)
                     if len(desc_lines) >= 3:  # 收集足够的描述
                         break
@@ -97,21 +135,10 @@ class TrainingConfigSetup:
         Returns:
             提示词
         """
-        # 关键词匹配，为不同类型的课程生成特定的提示词
-        prompt_templates = {
-            "离心泵": "工业化工厂，离心泵运行场景，技术人员在仔细检查泵的状态，高清现代化工业设备，蓝色和灰色调，工业气氛浓厚，精密检测仪器，16:9宽屏，电影级质感，光影细节丰富",
-            "汽蚀": "工业现场，泵的故障诊断场景，工程师手持诊断工具，高科技仪器，动态光线，深蓝色和银灰色调，紧张专业的工作氛围，16:9宽屏，科技感十足",
-            "精馏": "化学实验室，精馏装置运行中，液体流动通过冷凝管，蒸馏烧瓶加热，科学仪器精密排列，蓝白调，科技感强，专业教学环境，玻璃仪器闪烁反光，16:9宽屏，细节丰富",
-            "展馆": "现代科技展馆内部，宽敞明亮的展厅，各种创意展示品，参观者在互动体验，科技感强烈，现代建筑风格，柔和的照明，开放式空间，16:9宽屏，沉浸感十足",
-            "非暴力沟通": "温暖的协作工作室，两个人在进行深入沟通交流，放松的氛围，柔和的自然光线，绿植点缀，现代简约风格，友好和谐，16:9宽屏，人性化气氛",
-            "投资": "现代办公会议室，投资推介会场景，专业的演讲者，观众认真听讲，高档的会议设备，蓝色商务调，专业严谨的氛围，大屏幕显示，16:9宽屏，企业级质感",
-        }
-
-        # 匹配关键词并选择模板
-        combined_text = (task_name + " " + task_description).lower()
-        for keyword, template in prompt_templates.items():
-            if keyword.lower() in combined_text:
-                return template
+        # 关键词匹配，为不同类型的课程生成特定的提示词（多个命中时取优先级最高者）
+        matched = set(_PROMPT_KEYWORD_RE.findall(task_name + " " + task_description))
+        if matched:
+            return _PROMPT_TEMPLATES[min(matched, key=_PROMPT_KEYWORD_PRIORITY.__getitem__)]
 
         # 默认提示词（通用教学场景）
         default_prompt = (
@@ -132,19 +159,26 @@ class TrainingConfigSetup:
         Returns:
             图片URL
         """
-        try:
-            response = self.client.images.generate(
-                model=self.model,
-                prompt=prompt,
-                size="2K",  # 2560x1440，16:9比例
-                response_format="url",
-                extra_body={
-                    "watermark": True,
-                },
-            )
-            return response.data[0].url
-        except Exception as e:
-            raise RuntimeError(f"Doubao API调用失败: {str(e)}")
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                response = self.client.images.generate(
+                    model=self.model,
+                    prompt=prompt,
+                    size="2K",  # 2560x1440，16:9比例
+                    response_format="url",
+                    extra_body={
+                        "watermark": True,
+                    },
+                )
+                return response.data[0].url
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise RuntimeError(f"Doubao API调用失败: {str(e)}")
+                delay = _retry_delay(attempt)
+                print(f"   ⚠️ 封面图请求失败，{delay:.1f}s 后重试 ({attempt}/{MAX_ATTEMPTS}): {e}")
+                time.sleep(delay)
+            except Exception as e:
+                raise RuntimeError(f"Doubao API调用失败: {str(e)}")
 
     def create_config_structure(
         self,
@@ -152,7 +186,8 @@ class TrainingConfigSetup:
         task_description: str,
         cover_url: str,
         prompt: str,
-        doc_path: str
+        doc_path: str,
+        created_at: Optional[str] = None
     ) -> Dict:
         """
         创建基础配置结构
@@ -163,6 +198,7 @@ class TrainingConfigSetup:
             cover_url: 封面图URL
             prompt: 生成提示词
             doc_path: 源文档路径
+            created_at: 创建时间（为None时取当前时间）
 
         Returns:
             配置字典
@@ -178,19 +214,26 @@ class TrainingConfigSetup:
                 "model": self.model
             },
             "metadata": {
-                "createdAt": datetime.now().isoformat() + "Z",
+                "createdAt": created_at or _utc_timestamp(),
                 "source": doc_path
             }
         }
 
-    def process(self, md_content: str, doc_path: str, output_dir: Optional[str] = None) -> Tuple[Dict, str]:
+    async def process(
+        self,
+        md_content: str,
+        doc_path: str,
+        output_dir: Optional[str] = None,
+        force: bool = False
+    ) -> Tuple[Dict, str]:
         """
-        完整处理流程
+        完整处理流程（封面图生成期间并行完成目录创建和提示词保存）
 
         Args:
             md_content: markdown文件内容
             doc_path: 文档路径
             output_dir: 输出目录（如果为None，则自动创建）
+            force: 为True时即使已有基础配置.json也重新生成
 
         Returns:
             (配置字典, 输出目录路径)
@@ -201,26 +244,50 @@ class TrainingConfigSetup:
         print(f"   ✓ 任务名称: {task_name}")
         print(f"   ✓ 任务描述: {task_description[:50]}...")
 
+        if output_dir is None:
+            # 自动创建以任务名称命名的目录
+            output_dir = Path(doc_path).parent / task_name
+        else:
+            output_dir = Path(output_dir)
+        config_path = output_dir / "基础配置.json"
+
+        # 已生成过则直接复用，避免重复调用图片接口
+        if not force and config_path.exists() and config_path.stat().st_size > 0:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            print(f"\n♻️  已存在配置，跳过生成（使用 --force 重新生成）: {config_path}")
+            return config, str(output_dir)
+
         # 生成提示词
         print("\n🎨 生成封面图提示词...")
         cover_prompt = self.generate_cover_prompt(task_name, task_description)
         print(f"   ✓ 提示词: {cover_prompt[:60]}...")
 
-        # 生成封面图
+        # 生成封面图：立即提交到线程池（与同步调用共用同一个重试逻辑），
+        # 下面的文件写入也放到线程中，期间事件循环可以推进其他文档
         print("\n🖼️  调用Doubao生成封面图...")
-        cover_url = self.generate_cover_image(cover_prompt)
-        print(f"   ✓ 成功生成! URL: {cover_url[:80]}...")
-
-        # 创建输出目录
-        if output_dir is None:
-            # 自动创建以任务名称命名的目录
-            doc_dir = Path(doc_path).parent
-            output_dir = doc_dir / task_name
-        else:
-            output_dir = Path(output_dir)
+        image_future = asyncio.get_running_loop().run_in_executor(
+            None, self.generate_cover_image, cover_prompt
+        )
+        created_at = _utc_timestamp()
 
-        output_dir.mkdir(parents=True, exist_ok=True)
-        print(f"\n📁 输出目录: {output_dir}")
+        try:
+            prompt_path = await asyncio.to_thread(
+                self._save_cover_prompt, output_dir, task_name, cover_prompt, created_at
+            )
+            print(f"\n📁 输出目录: {output_dir}")
+            print(f"   ✓ 提示词已保存: {prompt_path}")
+        except Exception:
+            # 封面图请求已在线程中执行，无法取消：等它结束并记录结果，避免付费调用的结果被静默丢弃
+            try:
+                cover_url = await image_future
+                print(f"   ⚠️ 提示词保存失败，但封面图已生成: {cover_url}")
+            except Exception as image_error:
+                print(f"   ⚠️ 提示词保存失败，封面图生成也失败: {image_error}")
+            raise
+
+        cover_url = await image_future
+        print(f"   ✓ 成功生成! URL: {cover_url[:80]}...")
 
         # 创建配置结构
         config = self.create_config_structure(
@@ -228,50 +295,110 @@ class TrainingConfigSetup:
             task_description,
             cover_url,
             cover_prompt,
-            doc_path
+            doc_path,
+            created_at
         )
 
         # 保存JSON配置
-        config_path = output_dir / "基础配置.json"
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        await asyncio.to_thread(self._save_config, config_path, config)
         print(f"   ✓ 配置已保存: {config_path}")
 
-        # 保存提示词
+        return config, str(output_dir)
+
+    def _save_cover_prompt(
+        self, output_dir: Path, task_name: str, cover_prompt: str, created_at: str
+    ) -> Path:
+        """创建输出目录并保存封面图提示词，返回提示词文件路径"""
+        output_dir.mkdir(parents=True, exist_ok=True)
         prompt_path = output_dir / "封面图提示词.txt"
-        with open(prompt_path, 'w', encoding='utf-8') as f:
-            f.write(f"任务: {task_name}\n")
-            f.write(f"生成时间: {config['metadata']['createdAt']}\n")
-            f.write(f"模型: {self.model}\n")
-            f.write(f"图片格式: 16:9 (2560x1440)\n")
-            f.write(f"================\n\n")
-            f.write(cover_prompt)
-        print(f"   ✓ 提示词已保存: {prompt_path}")
+        prompt_path.write_text(
+            f"任务: {task_name}\n"
+            f"生成时间: {created_at}\n"
+            f"模型: {self.model}\n"
+            "图片格式: 16:9 (2560x1440)\n"
+            "================\n\n"
+            f"{cover_prompt}",
+            encoding='utf-8'
+        )
+        return prompt_path
+
+    @staticmethod
+    def _save_config(config_path: Path, config: Dict):
+        """保存JSON配置"""
+        if orjson is not None:
+            config_path.write_bytes(orjson.dumps(config, option=orjson.OPT_INDENT_2))
+        else:
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump(config, f, ensure_ascii=False, indent=2)
 
-        return config, str(output_dir)
+
+# 批量处理时同时进行的文档数量上限
+MAX_CONCURRENCY = 4
+
+
+async def process_many(
+    generator: TrainingConfigSetup,
+    md_files: Dict[str, str],
+    force: bool = False
+) -> list:
+    """并发处理多个文档，返回与输入顺序一致的结果或异常"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def run_one(md_path: str, md_content: str):
+        async with semaphore:
+            return await generator.process(md_content, md_path, force=force)
+
+    return await asyncio.gather(
+        *(run_one(md_path, md_content) for md_path, md_content in md_files.items()),
+        return_exceptions=True,
+    )
 
 
 def main():
     """CLI入口"""
-    if len(sys.argv) < 2:
-        print("使用方法: python config_generator.py <markdown_file_path>")
+    args = sys.argv[1:]
+    force = "--force" in args
+    md_paths = [arg for arg in args if arg != "--force"]
+    if not md_paths:
+        print("使用方法: python config_generator.py [--force] <markdown_file_path> [<markdown_file_path> ...]")
         sys.exit(1)
 
-    md_path = sys.argv[1]
-
     # 读取markdown文件
-    try:
-        with open(md_path, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-    except FileNotFoundError:
-        print(f"❌ 文件不存在: {md_path}")
-        sys.exit(1)
+    md_files = {}
+    for md_path in md_paths:
+        try:
+            # 直接解码字节，省去换行转换；提取逻辑兼容 \r\n
+            md_files[md_path] = Path(md_path).read_bytes().decode('utf-8')
+        except FileNotFoundError:
+            print(f"❌ 文件不存在: {md_path}")
+            sys.exit(1)
 
     # 处理
     try:
         generator = TrainingConfigSetup()
-        config, output_dir = generator.process(md_content, md_path)
+    except ValueError as e:
+        print(f"❌ 配置错误: {e}")
+        sys.exit(1)
 
+    results = asyncio.run(process_many(generator, md_files, force=force))
+
+    failed = False
+    for md_path, result in zip(md_files, results):
+        if isinstance(result, Exception):
+            # 单个文档失败（包括写文件出错、未重试的 API 错误）不影响其他文档的汇总
+            if isinstance(result, ValueError):
+                prefix = "配置错误: "
+            elif isinstance(result, RuntimeError):
+                prefix = ""
+            else:
+                prefix = f"{type(result).__name__}: "
+            print(f"\n❌ {md_path}: {prefix}{result}")
+            failed = True
+            continue
+        if isinstance(result, BaseException):
+            raise result
+
+        config, output_dir = result
         print("\n✨ 成功完成!")
         print(f"\n📋 生成的配置:")
         print(f"   任务名称: {config['taskName']}")
@@ -279,11 +406,7 @@ def main():
         print(f"   封面图URL: {config['coverImage']['url']}")
         print(f"\n📂 输出目录: {output_dir}")
 
-    except ValueError as e:
-        print(f"❌ 配置错误: {e}")
-        sys.exit(1)
-    except RuntimeError as e:
-        print(f"❌ {e}")
+    if failed:
         sys.exit(1)
 
 
@@ -4,21 +4,49 @@
 """
 
 import asyncio
+import atexit
+import contextlib
 import websockets
 import json
 import logging
 import io
 import os
 import sys
-import math
 import time
+import importlib
 import importlib.util
+import queue
+import shutil
+import subprocess
+import threading
+import wave
+from collections import deque
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Iterable
 from dotenv import load_dotenv
 import requests
 
+try:
+    import orjson  # 可选：更快的 JSON 解析/序列化
+except ImportError:
+    orjson = None
+
+
+def _json_loads(data):
+    """解析 JSON（str 或 bytes）；安装了 orjson 时走 orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> str:
+    """序列化为 JSON 文本帧；安装了 orjson 时走 orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj)
+
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 log = logging.getLogger(__name__)
 
@@ -26,6 +54,11 @@ log = logging.getLogger(__name__)
 # 加载环境变量
 load_dotenv()
 
+WS_HEADERS = {
+    "Origin": "https://hike-teaching-center.polymas.com",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
+}
+
 CONFIG = {
     "ws_url": "wss://cloudapi.polymas.com/ai-tools/ws/v2/trainFlow",
     "task_id": os.getenv("TASK_ID"),
@@ -54,13 +87,15 @@ LANG_CONFIGS = {
     },
 }
 
-def get_user_info():
+# 共享的 HTTP 会话：复用 TCP/TLS 连接，避免每次请求都重新握手
+http_session = requests.Session()
+
+
+def get_auth_headers() -> Dict[str, str]:
     """
-    调用 API 获取用户和学校信息
-    失败时退出程序并提示错误
+    从环境变量构建认证请求头
+    缺少 AUTHORIZATION 或 COOKIE 时立即退出程序并提示错误
     """
-    url = "https://cloudapi.polymas.com/console/v1/get-current-user-detail"
-
     authorization = os.getenv("AUTHORIZATION")
     cookie = os.getenv("COOKIE")
 
@@ -69,35 +104,59 @@ def get_user_info():
         print("请在 .env 文件中配置这些参数")
         sys.exit(1)
 
-    headers = {
+    return {
         "Authorization": authorization,
         "Cookie": cookie,
         "Content-Type": "application/json"
     }
 
-    try:
-        response = requests.post(url, headers=headers)
-        response.raise_for_status()  # 检查 HTTP 错误
 
-        data = response.json()
+def fetch_user_info(headers: Dict[str, str]):
+    """
+    调用 API 获取用户和学校信息（不打印、不退出，可放到后台线程执行）
+    失败时抛出异常，由 report_user_info_error 统一提示
+    """
+    url = "https://cloudapi.polymas.com/console/v1/get-current-user-detail"
+
+    response = http_session.post(url, headers=headers, timeout=10)
+    response.raise_for_status()  # 检查 HTTP 错误
+
+    data = _json_loads(response.content)
+
+    if data.get("code") != 200 or not data.get("success"):
+        raise RuntimeError(f"API 调用失败：{data.get('msg', '未知错误')}")
 
-        if data.get("code") != 200 or not data.get("success"):
-            print(f"❌ API 调用失败：{data.get('msg', '未知错误')}")
-            sys.exit(1)
+    user_id = data["data"]["userNid"]
+    school_id = data["data"]["schoolInfo"]["nid"]
 
-        user_id = data["data"]["userNid"]
-        school_id = data["data"]["schoolInfo"]["nid"]
+    return user_id, school_id
 
-        return user_id, school_id
 
-    except requests.exceptions.RequestException as e:
-        print(f"❌ 网络请求失败：{e}")
+def report_user_info_error(error: BaseException):
+    """提示 fetch_user_info 的失败原因并退出程序；无法识别的异常原样抛出"""
+    if isinstance(error, RuntimeError):
+        print(f"❌ {error}")
+    elif isinstance(error, requests.exceptions.RequestException):
+        print(f"❌ 网络请求失败：{error}")
         print("请检查网络连接和认证信息（AUTHORIZATION, COOKIE）")
-        sys.exit(1)
-    except (KeyError, TypeError) as e:
-        print(f"❌ API 响应格式错误：{e}")
+    elif isinstance(error, (KeyError, TypeError, ValueError)):
+        print(f"❌ API 响应格式错误：{error}")
         print("响应数据格式不符合预期")
-        sys.exit(1)
+    else:
+        raise error
+    sys.exit(1)
+
+
+def get_user_info():
+    """
+    调用 API 获取用户和学校信息
+    失败时退出程序并提示错误
+    """
+    headers = get_auth_headers()
+    try:
+        return fetch_user_info(headers)
+    except Exception as e:
+        report_user_info_error(e)
 
 AUDIO_CONFIG = {
     "sample_rate": 16000,
@@ -107,8 +166,96 @@ AUDIO_CONFIG = {
     "frame_header": bytes([0x11, 0x20, 0x10, 0x00, 0x00, 0x00, 0x0c, 0x80]),
     "chunk_interval": 0.1,
     "silence_frames": 30,
+    "max_pending_sends": 4,  # 允许同时在途的音频帧发送数
+    # 每条 websocket 消息打包的帧数；服务端按 8 字节帧头切分时可调大以减少消息数，默认逐帧发送
+    "frames_per_send": max(1, int(os.getenv("AUDIO_FRAMES_PER_SEND", "1"))),
+}
+
+try:
+    from aioconsole import ainput as _aioconsole_ainput  # 可选：原生异步读取 stdin
+except ImportError:
+    _aioconsole_ainput = None
+
+
+_stdin_requests: "queue.SimpleQueue" = queue.SimpleQueue()
+_stdin_thread: Optional[threading.Thread] = None
+
+
+def _stdin_reader():
+    """专用的 stdin 读取线程：逐个处理 ainput 请求，把结果交回事件循环"""
+    while True:
+        prompt, loop, future = _stdin_requests.get()
+        result, error = None, None
+        try:
+            result = input(prompt)
+        except BaseException as exc:  # EOFError / KeyboardInterrupt 交给调用方处理
+            error = exc
+        try:
+            loop.call_soon_threadsafe(_resolve_stdin_future, future, result, error)
+        except RuntimeError:
+            pass  # 事件循环已关闭，丢弃这行输入
+
+
+def _resolve_stdin_future(future: asyncio.Future, result, exc):
+    if future.done():  # 等待方已取消
+        return
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(result)
+
+
+async def ainput(prompt: str = "") -> str:
+    """
+    异步读取一行输入；未安装 aioconsole 时交给专用的 stdin 守护线程执行 input()，
+    不占用默认线程池（DNS 解析、to_thread 的 HTTP 调用都走默认线程池），
+    守护线程也不会因为阻塞在 input() 上而拖住进程退出
+    """
+    if _aioconsole_ainput is not None:
+        return await _aioconsole_ainput(prompt)
+    global _stdin_thread
+    if _stdin_thread is None:
+        _stdin_thread = threading.Thread(target=_stdin_reader, name="stdin", daemon=True)
+        _stdin_thread.start()
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _stdin_requests.put((prompt, loop, future))
+    return await future
+
+
+async def _aiter(items: Iterable) -> AsyncIterator:
+    """把普通可迭代对象包装成异步迭代器"""
+    for item in items:
+        yield item
+
+# RESAMPLER_QUALITY（samplerate 的转换器名）到 soxr 质量档位的对应关系
+_SOXR_QUALITY = {
+    "zero_order_hold": "QQ",
+    "linear": "QQ",
+    "sinc_fastest": "LQ",
+    "sinc_medium": "MQ",
+    "sinc_best": "HQ",
 }
 
+# 半交互模式的固定提示文本，整块一次写出
+_SEMI_MODE_BANNER = (
+    "\n" + "=" * 60 + "\n"
+    "📢 半交互模式\n"
+    + "=" * 60 + "\n"
+    "说明：\n"
+    "  - [回车] AI 自动生成回答\n"
+    "  - [输入文字] 使用你的回答\n"
+    "  - [continue] 切换到全自动模式\n"
+    "  - [quit] 退出\n"
+    + "=" * 60 + "\n\n"
+)
+_SEMI_PROMPT_BANNER = (
+    "\n" + "-" * 60 + "\n"
+    "💬 请输入回答:\n"
+    "   [回车] AI 生成 | [输入文字] 手动 | [continue] 全自动 | [quit] 退出\n"
+    + "-" * 60 + "\n"
+)
+
 # ============ 日志记录器 ============
 class ConversationLogger:
     def __init__(self, task_id: str):
@@ -121,12 +268,16 @@ class ConversationLogger:
         self.task_id = task_id
         self.creation_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        # 创建日志文件并写入头部
-        with open(self.log_file, 'w', encoding='utf-8') as f:
-            f.write("对话记录\n")
-            f.write(f"日志创建时间: {self.creation_time}\n")
-            f.write(f"task_id: {task_id}\n")
-            f.write("="*60 + "\n")
+        # 创建日志文件并写入头部；句柄在会话期间保持打开（行缓冲），避免每条日志都 open/close
+        self._fh = open(self.log_file, 'w', encoding='utf-8', buffering=1)
+        self._fh.write(
+            "对话记录\n"
+            f"日志创建时间: {self.creation_time}\n"
+            f"task_id: {task_id}\n"
+            + "="*60 + "\n"
+        )
+        # 异常退出（未走 disconnect）时也保证文件被关闭
+        atexit.register(self.close)
 
     def log(self, role: str, content: str, step_name: str, step_id: str, round_num: int, source: str, user_content: str = None):
         """
@@ -149,21 +300,30 @@ class ConversationLogger:
             first_line += f" | 第 {round_num} 轮"
         first_line += f" | 来源: {source}"
 
-        # 写入日志文件
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(first_line + "\n")
+        # 拼成一整块后单次写入日志文件
+        lines = [first_line]
+        terminal = []
+        # 如果有用户消息（chat模式），先写用户消息
+        if user_content:
+            lines.append(f"用户: {user_content}")
+            terminal.append(f"\n👤 用户: {user_content}")
 
-            # 如果有用户消息（chat模式），先写用户消息
-            if user_content:
-                f.write(f"用户: {user_content}\n")
-                print(f"\n👤 用户: {user_content}")
+        # 写入AI消息
+        lines.append(f"AI: {content}")
+        lines.append("-"*80)
 
-            # 写入AI消息
-            f.write(f"AI: {content}\n")
-            f.write("-"*80 + "\n")
+        if self._fh.closed:  # close() 之后仍有日志时重新以追加模式打开
+            self._fh = open(self.log_file, 'a', encoding='utf-8', buffering=1)
+        self._fh.write("\n".join(lines) + "\n")
 
-        # 终端输出AI消息
-        print(f"🤖 AI: {content}")
+        # 终端输出（用户消息 + AI消息一次写出）
+        terminal.append(f"🤖 AI: {content}")
+        print("\n".join(terminal))
+
+    def close(self):
+        """刷新并关闭日志文件句柄（可重复调用）"""
+        if not self._fh.closed:
+            self._fh.close()
 
 # ============ 音频处理 ============
 class AudioProcessor:
@@ -173,10 +333,56 @@ class AudioProcessor:
         self.sample_width = AUDIO_CONFIG["sample_width"]
         self.pcm_chunk_size = AUDIO_CONFIG["pcm_chunk_size"]
         self.frame_header = AUDIO_CONFIG["frame_header"]
+        # 静音帧内容固定，只构建一次
+        self._silence_frame = self.frame_header + b'\x00' * self.pcm_chunk_size
+        # 每段语音末尾的静音帧整体也固定不变：预先拼好一整块，并切出逐帧视图
+        self._silence_tail = self._silence_frame * AUDIO_CONFIG["silence_frames"]
+        tail_view = memoryview(self._silence_tail)
+        frame_size = len(self._silence_frame)
+        self._silence_tail_frames = [
+            tail_view[i:i + frame_size] for i in range(0, len(self._silence_tail), frame_size)
+        ]
+        # 解码输出参数只构建一次（ffmpeg 管道与 PyAV 重采样器）
+        self._ffmpeg_output_args = ["-ar", str(self.sample_rate), "-ac", str(self.channels)]
+        self._resampler_args = {"format": "s16", "layout": "mono", "rate": self.sample_rate}
+
+        # samplerate 重采样质量：TTS 语音送 ASR，linear 已足够；可通过环境变量切换为 sinc_* 系列
+        self.resampler_quality = os.getenv("RESAMPLER_QUALITY", "linear").lower()
+        if self.resampler_quality not in {"linear", "zero_order_hold", "sinc_fastest", "sinc_medium", "sinc_best"}:
+            log.warning(f"⚠️ 未知 RESAMPLER_QUALITY={self.resampler_quality}，回退到 linear")
+            self.resampler_quality = "linear"
+
+        # 有 soxr 时优先用它重采样（SIMD 实现，直接处理 int16），否则用 samplerate
+        self.resampler_lib = "soxr" if importlib.util.find_spec("soxr") is not None else "samplerate"
+
+        # 是否支持边下载边解码（需要 PyAV）；只在启动时检测一次
+        self.can_stream_mp3 = importlib.util.find_spec("av") is not None
 
         # 检测并选择音频后端
         self.backend = self._detect_audio_backend()
         log.info(f"🎵 音频后端: {self.backend}")
+        self._preload_backend_modules()
+
+    def _preload_backend_modules(self):
+        """
+        启动时预先导入所选后端依赖的模块
+
+        首次 import numpy/miniaudio/av 等较慢，放在启动阶段而不是第一句语音；
+        解码方法里的局部 import 之后只是一次 sys.modules 查找。
+        """
+        modules = {
+            "miniaudio": ("miniaudio", "numpy", self.resampler_lib),
+            "av": ("av",),
+            "pydub": ("pydub",),
+        }.get(self.backend, ())
+        if self.can_stream_mp3 and "av" not in modules:
+            modules += ("av",)  # 流式 TTS 解码同样依赖 PyAV
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                # 解码时会按原有逻辑回退，这里只提示
+                log.warning(f"⚠️ 预加载 {name} 失败: {e}")
 
     def _detect_audio_backend(self) -> str:
         """检测可用的音频后端"""
@@ -186,30 +392,67 @@ class AudioProcessor:
             return "pydub"
         elif backend_preference == "miniaudio":
             return "miniaudio"
+        elif backend_preference == "av":
+            return "av"
+        elif backend_preference == "ffmpeg":
+            return "ffmpeg"
 
-        # auto 模式：优先 miniaudio
+        # auto 模式：优先 miniaudio，其次 PyAV（均为进程内解码），再次 ffmpeg 管道，最后 pydub
         has_miniaudio = importlib.util.find_spec("miniaudio") is not None
-        has_samplerate = importlib.util.find_spec("samplerate") is not None
-        if has_miniaudio and has_samplerate:
+        has_resampler = self.resampler_lib == "soxr" or importlib.util.find_spec("samplerate") is not None
+        if has_miniaudio and has_resampler:
             return "miniaudio"
 
-        log.warning("⚠️ miniaudio/samplerate 不可用，回退到 pydub")
+        if importlib.util.find_spec("av") is not None:
+            return "av"
+
+        if shutil.which("ffmpeg"):
+            return "ffmpeg"
+
+        log.warning("⚠️ miniaudio(+soxr/samplerate)/av/ffmpeg 均不可用，回退到 pydub")
         return "pydub"
 
     def mp3_to_pcm(self, mp3_data: bytes) -> bytes:
         """
         将 MP3 转换为 PCM
-        支持两种后端：
+        支持三种后端：
         - miniaudio: 无需 ffmpeg (推荐)
+        - av: PyAV 进程内解码 + 重采样，无需启动 ffmpeg 子进程
+        - ffmpeg: 通过管道调用 ffmpeg，一次完成解码/重采样/转单声道
         - pydub: 需要 ffmpeg (备选)
         """
+        # TTS 直接返回目标格式的 WAV（如 TTS_RESPONSE_FORMAT=wav）时，去掉文件头即可，无需解码
+        pcm_data = self._wav_passthrough(mp3_data)
+        if pcm_data is not None:
+            return pcm_data
+
         if self.backend == "miniaudio":
             return self._mp3_to_pcm_miniaudio(mp3_data)
+        elif self.backend == "av":
+            return self._mp3_to_pcm_av(mp3_data)
+        elif self.backend == "ffmpeg":
+            return self._mp3_to_pcm_ffmpeg(mp3_data)
         else:
             return self._mp3_to_pcm_pydub(mp3_data)
 
+    def _wav_passthrough(self, audio_data: bytes) -> Optional[bytes]:
+        """若数据已是 16k/单声道/16bit 的 WAV，直接返回其中的 PCM；否则返回 None"""
+        if audio_data[:4] != b"RIFF" or audio_data[8:12] != b"WAVE":
+            return None
+        try:
+            with wave.open(io.BytesIO(audio_data), "rb") as wav:
+                if (
+                    wav.getframerate() != self.sample_rate
+                    or wav.getnchannels() != self.channels
+                    or wav.getsampwidth() != self.sample_width
+                ):
+                    return None
+                return wav.readframes(wav.getnframes())
+        except (wave.Error, EOFError):
+            return None
+
     def _mp3_to_pcm_miniaudio(self, mp3_data: bytes) -> bytes:
-        """使用 miniaudio + samplerate，无需 ffmpeg"""
+        """使用 miniaudio + soxr/samplerate，无需 ffmpeg"""
         try:
             import miniaudio
             import numpy as np
@@ -221,18 +464,29 @@ class AudioProcessor:
 
             # 转单声道
             if decoded.nchannels == 2:
-                audio_array = audio_array.reshape(-1, 2).mean(axis=1).astype(np.int16)
+                # 整数求平均：int32 中间结果防溢出，避免 mean() 产生 float64 临时数组
+                stereo = audio_array.reshape(-1, 2).astype(np.int32)
+                audio_array = ((stereo[:, 0] + stereo[:, 1]) >> 1).astype(np.int16)
             elif decoded.nchannels != 1:
                 raise ValueError(f"不支持的声道数: {decoded.nchannels}")
 
-            # 重采样
-            if decoded.sample_rate != self.sample_rate:
+            # 重采样（采样率已是目标值时直接跳过）
+            if decoded.sample_rate != self.sample_rate and self.resampler_lib == "soxr":
+                import soxr
+                # soxr 直接接受并返回 int16，省去浮点往返
+                audio_array = soxr.resample(
+                    audio_array, decoded.sample_rate, self.sample_rate,
+                    quality=_SOXR_QUALITY[self.resampler_quality],
+                )
+            elif decoded.sample_rate != self.sample_rate:
                 import samplerate
-                # samplerate 需要归一化的浮点数组 [-1.0, 1.0]
-                audio_float = audio_array.astype(np.float32) / 32768.0
+                # samplerate 需要归一化的浮点数组 [-1.0, 1.0]；原地缩放避免再分配一块临时数组
+                audio_float = audio_array.astype(np.float32)
+                audio_float *= 1.0 / 32768.0
                 ratio = self.sample_rate / decoded.sample_rate
-                audio_resampled = samplerate.resample(audio_float, ratio, 'sinc_fastest')
-                audio_array = (audio_resampled * 32768.0).astype(np.int16)
+                audio_resampled = samplerate.resample(audio_float, ratio, self.resampler_quality)
+                audio_resampled *= 32768.0
+                audio_array = audio_resampled.astype(np.int16)
 
             return audio_array.tobytes()
 
@@ -242,6 +496,111 @@ class AudioProcessor:
             self.backend = "pydub"
             return self._mp3_to_pcm_pydub(mp3_data)
 
+    def _mp3_to_pcm_av(self, mp3_data: bytes) -> bytes:
+        """使用 PyAV (libav) 在进程内解码并重采样为 16k/单声道/s16"""
+        try:
+            import av
+
+            resampler = av.AudioResampler(**self._resampler_args)
+            pcm = bytearray()
+            with av.open(io.BytesIO(mp3_data)) as container:
+                for frame in container.decode(audio=0):
+                    for out in resampler.resample(frame):
+                        pcm += memoryview(out.planes[0])[:out.samples * self.sample_width]
+            # 冲刷重采样器中残留的样本
+            for out in resampler.resample(None):
+                pcm += memoryview(out.planes[0])[:out.samples * self.sample_width]
+            return bytes(pcm)
+
+        except Exception as e:
+            log.error(f"❌ PyAV 转换失败: {e}，尝试回退到 pydub")
+            self.backend = "pydub"
+            return self._mp3_to_pcm_pydub(mp3_data)
+
+    def _mp3_to_pcm_ffmpeg(self, mp3_data: bytes) -> bytes:
+        """通过 stdin/stdout 管道调用 ffmpeg，直接输出 16k/单声道/s16le 的裸 PCM"""
+        try:
+            proc = subprocess.run(
+                [
+                    "ffmpeg", "-v", "error", "-i", "pipe:0",
+                    "-f", "s16le", "-acodec", "pcm_s16le",
+                    *self._ffmpeg_output_args,
+                    "pipe:1",
+                ],
+                input=mp3_data,
+                capture_output=True,
+                check=True,
+            )
+            return proc.stdout
+
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.error(f"❌ ffmpeg 转换失败: {e}，尝试回退到 pydub")
+            self.backend = "pydub"
+            return self._mp3_to_pcm_pydub(mp3_data)
+
+    async def stream_mp3_to_pcm(self, mp3_chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        逐块解码 MP3 流，产出 16k/单声道/s16 的 PCM 片段
+
+        解析/解码/重采样都是阻塞的 C 调用，逐块放到线程中执行，避免卡住心跳和 WebSocket 写者；
+        每块都等上一块处理完才提交，解码器状态不会被并发访问。
+        """
+        import av
+
+        codec = av.CodecContext.create("mp3", "r")
+        resampler = av.AudioResampler(**self._resampler_args)
+
+        def convert(packets) -> bytearray:
+            pcm = bytearray()
+            for packet in packets:
+                for frame in codec.decode(packet):
+                    for out in resampler.resample(frame):
+                        pcm += memoryview(out.planes[0])[:out.samples * self.sample_width]
+            return pcm
+
+        def decode_chunk(chunk: bytes) -> bytes:
+            return bytes(convert(codec.parse(chunk)))
+
+        def flush() -> bytes:
+            # 冲刷解析器、解码器和重采样器中残留的数据
+            tail = convert(codec.parse(None))
+            tail += convert([None])
+            for out in resampler.resample(None):
+                tail += memoryview(out.planes[0])[:out.samples * self.sample_width]
+            return bytes(tail)
+
+        # 提前停止时逐层关闭上游生成器，TTS 连接随之立即释放而不是等到 GC
+        async with contextlib.aclosing(mp3_chunks):
+            async for chunk in mp3_chunks:
+                pcm = await asyncio.to_thread(decode_chunk, chunk)
+                if pcm:
+                    yield pcm
+
+        tail = await asyncio.to_thread(flush)
+        if tail:
+            yield tail
+
+    async def stream_frames(self, pcm_chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """把任意长度的 PCM 片段流切分成音频帧，最后补上静音帧"""
+        pending = bytearray()
+        chunk_size = self.pcm_chunk_size
+        async with contextlib.aclosing(pcm_chunks):
+            async for pcm in pcm_chunks:
+                pending += pcm
+                if len(pending) < chunk_size:
+                    continue
+                # 整帧直接由帧头与缓冲区视图拼接成 bytes，每帧只分配一次
+                whole = len(pending) - len(pending) % chunk_size
+                with memoryview(pending) as view:
+                    frames = [self.frame_header + view[i:i + chunk_size] for i in range(0, whole, chunk_size)]
+                del pending[:whole]
+                for frame in frames:
+                    yield frame
+        if pending:
+            yield self.create_frame(bytes(pending))
+        for frame in self._silence_tail_frames:
+            yield frame
+
     def _mp3_to_pcm_pydub(self, mp3_data: bytes) -> bytes:
         """使用 pydub + ffmpeg (备选方案)"""
         from pydub import AudioSegment
@@ -253,23 +612,44 @@ class AudioProcessor:
     
     def create_frame(self, pcm_chunk: bytes) -> bytes:
         if len(pcm_chunk) < self.pcm_chunk_size:
-            pcm_chunk = pcm_chunk + b'\x00' * (self.pcm_chunk_size - len(pcm_chunk))
+            # 不足一帧：在静音帧模板上覆盖数据，补零部分无需再分配
+            frame = bytearray(self._silence_frame)
+            header_size = len(self.frame_header)
+            frame[header_size:header_size + len(pcm_chunk)] = pcm_chunk
+            return bytes(frame)
         return self.frame_header + pcm_chunk
     
     def create_silence_frame(self) -> bytes:
-        silence = b'\x00' * self.pcm_chunk_size
-        return self.frame_header + silence
+        return self._silence_frame
     
-    def create_frames(self, pcm_data: bytes) -> List[bytes]:
-        frames = []
-        for i in range(0, len(pcm_data), self.pcm_chunk_size):
-            pcm_chunk = pcm_data[i:i + self.pcm_chunk_size]
-            frames.append(self.create_frame(pcm_chunk))
-        
-        for _ in range(AUDIO_CONFIG["silence_frames"]):
-            frames.append(self.create_silence_frame())
-        
-        return frames
+    def create_frames(self, pcm_data: bytes) -> List[memoryview]:
+        """
+        一次性构建所有音频帧（含末尾静音帧）
+
+        所有帧共用一块连续缓冲区，返回的是各帧的 memoryview 切片，
+        避免每帧单独分配 bytes；缓冲区初始为全零，补齐无需额外写入，
+        末尾静音直接整块拷贝预先构建的 _silence_tail。
+        """
+        header_size = len(self.frame_header)
+        frame_size = header_size + self.pcm_chunk_size
+        audio_frame_count = -(-len(pcm_data) // self.pcm_chunk_size)
+        total_frames = audio_frame_count + AUDIO_CONFIG["silence_frames"]
+        audio_size = frame_size * audio_frame_count
+
+        buffer = bytearray(audio_size)
+        # 按字节步长批量写入帧头：每个帧头字节只需一次切片赋值
+        for offset, value in enumerate(self.frame_header):
+            buffer[offset::frame_size] = bytes((value,)) * audio_frame_count
+
+        pcm_view = memoryview(pcm_data)
+        for i in range(audio_frame_count):
+            pcm_chunk = pcm_view[i * self.pcm_chunk_size:(i + 1) * self.pcm_chunk_size]
+            start = i * frame_size + header_size
+            buffer[start:start + len(pcm_chunk)] = pcm_chunk
+        buffer += self._silence_tail
+
+        frames_view = memoryview(buffer)
+        return [frames_view[i * frame_size:(i + 1) * frame_size] for i in range(total_frames)]
 
 # ============ TTS引擎 ============
 class TTSEngine:
@@ -293,6 +673,13 @@ class TTSEngine:
             log.warning(f"⚠️ 未知 TTS_PROVIDER={self.provider}，回退到 auto")
             self.provider = "auto"
 
+        # 启动时预先导入 edge_tts，首句语音不再承担导入开销
+        if "edge" in self._provider_chain():
+            try:
+                importlib.import_module("edge_tts")
+            except ImportError as e:
+                log.warning(f"⚠️ 预加载 edge_tts 失败: {e}")
+
         log.info(
             "🔊 TTS配置: provider=%s, fallback_url=%s, model=%s, voice=%s, retries=%s",
             self.provider,
@@ -350,6 +737,30 @@ class TTSEngine:
             raise ValueError("edge_tts 返回空音频")
         return bytes(audio_data)
 
+    @property
+    def prefers_edge(self) -> bool:
+        return self._provider_chain()[0] == "edge"
+
+    async def stream_with_edge(self, text: str) -> AsyncIterator[bytes]:
+        """边合成边产出 MP3 数据块，用于边解码边发送"""
+        import edge_tts
+
+        if not text or not text.strip():
+            raise ValueError("TTS 输入文本为空")
+
+        communicate = edge_tts.Communicate(text, self.voice)
+        received = 0
+        stream = communicate.stream()
+        async with contextlib.aclosing(stream):
+            async for chunk in stream:
+                if chunk.get("type") == "audio" and chunk.get("data"):
+                    received += len(chunk["data"])
+                    yield chunk["data"]
+
+        if not received:
+            raise ValueError("edge_tts 返回空音频")
+        log.info("✅ TTS成功 provider=edge(stream) bytes=%s", received)
+
     async def _synthesize_with_polymas(self, text: str) -> bytes:
         if not self.polymas_api_key:
             raise ValueError("Polymas TTS 缺少 api-key（TTS_API_KEY 或 LLM_API_KEY）")
@@ -370,7 +781,7 @@ class TTSEngine:
         }
 
         response = await asyncio.to_thread(
-            requests.post,
+            http_session.post,
             self.polymas_tts_url,
             headers=headers,
             json=payload,
@@ -433,21 +844,48 @@ class TrainingClient:
     def __init__(self, lang: str = "en"):
         self.ws: Optional[websockets.WebSocketClientProtocol] = None
         self.logger = ConversationLogger(CONFIG["task_id"])  # 传入 task_id
+        self._ws_url = f"{CONFIG['ws_url']}?taskId={CONFIG['task_id']}"
         self.lang = lang if lang in LANG_CONFIGS else "en"
         self.lang_config = LANG_CONFIGS[self.lang]
         self.tts = TTSEngine(voice=self.lang_config["tts_voice"])
         self.audio = AudioProcessor()
 
-        # WebSocket 发送互斥锁：避免音频帧与控制消息（nextStep/heartBeat 等）交错发送
+        # WebSocket 发送互斥锁：控制消息（nextStep/heartBeat 等）发送期间不插入音频帧；
+        # 音频按帧获取，不会在整段语音期间一直占用
         self._ws_send_lock = asyncio.Lock()
 
+        # 单写者发送队列：所有 ws.send 都由 _writer_loop 依次发出
+        self._send_queue: deque = deque()
+        self._send_waker: Optional[asyncio.Future] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._last_send_ts = 0.0  # 最近一次 ws.send 完成的 loop.time()
+
+        # 服务器事件 -> 处理方法（O(1) 分发，替代逐个比较事件名）
+        self._event_handlers = {
+            "connected": self._on_connected,
+            "botAnswerStart": self._on_bot_answer_start,
+            "botAnswer": self._on_bot_answer,
+            "botAnswerEnd": self._on_bot_answer_end,
+            "userTextStart": self._on_user_text_start,
+            "userText": self._on_user_text,
+            "userTextEnd": self._on_user_text_end,
+            "userAudioEnd": self._on_user_audio_end,
+            "stepEnd": self._on_step_end,
+            "taskEnd": self._on_task_end,
+            "error": self._on_error,
+        }
+
         self.session_id = None
         self.step_id = None
         self.step_name = None
         self.is_connected = False
+        # bot_speaking / waiting_response 的变化同步到事件上，等待方无需轮询
+        self._bot_idle_event = asyncio.Event()
+        self._response_done_event = asyncio.Event()
         self.bot_speaking = False
         self.waiting_response = False
         self.current_bot_msg = ""
+        self._bot_chunks: List[str] = []  # botAnswer 分片，botAnswerEnd 时一次性拼接
         self.current_history_id = ""
         self.task_completed = False
 
@@ -464,12 +902,16 @@ class TrainingClient:
         self.max_retries = int(os.getenv("MAX_RETRIES", "3"))  # 最大重试次数
         self.base_timeout = float(os.getenv("BASE_TIMEOUT", "90"))  # 基础超时时间（秒）
         self.heartbeat_without_response = 0  # 无响应的心跳计数
+        self.heartbeat_interval = 30  # 心跳检查间隔（秒）
+        self.heartbeat_idle_threshold = 25  # 距上次发送超过该秒数才补发心跳
+        self.heartbeat_log = os.getenv("HEARTBEAT_LOG", "0") == "1"  # 心跳默认只记 DEBUG 日志
 
         # 音频发送控制：用于在 userAudioEnd/stepEnd/botAnswerStart 时提前停止发送，避免跨步骤串音触发再次识别
         self._audio_stop_event: Optional[asyncio.Event] = None
         self._audio_sending = False
         self._audio_sending_done = asyncio.Event()
         self._audio_sending_done.set()
+        self._audio_frames_sent = 0
         self._next_step_task: Optional[asyncio.Task] = None
 
         # Bot 回复超时控制：避免 botAnswerStart 后一直不结束导致永远不重试
@@ -492,19 +934,100 @@ class TrainingClient:
         self.llm_service_code = os.getenv("LLM_SERVICE_CODE", "SI_Ability")
 
         # 对话历史（用于提供上下文）
-        self.conversation_history = []
+        self.conversation_history = deque(maxlen=10)  # 只保留最近10轮，append 自动淘汰最旧的一轮
         self.reference_dialogue_content: Optional[str] = None
         self.knowledge_base_content: Optional[str] = None
         self.reference_dialogue_path: Optional[str] = None
         self.knowledge_base_path: Optional[str] = None
 
+        # 提示词中不随轮次变化的部分，按 (档位, 对话记录, 知识库) 缓存
+        self._prompt_scaffold_key: Optional[tuple] = None
+        self._prompt_scaffold: tuple = ("", "")
+
+    @property
+    def bot_speaking(self) -> bool:
+        return not self._bot_idle_event.is_set()
+
+    @bot_speaking.setter
+    def bot_speaking(self, value: bool):
+        if value:
+            self._bot_idle_event.clear()
+        else:
+            self._bot_idle_event.set()
+
+    @property
+    def waiting_response(self) -> bool:
+        return not self._response_done_event.is_set()
+
+    @waiting_response.setter
+    def waiting_response(self, value: bool):
+        if value:
+            self._response_done_event.clear()
+        else:
+            self._response_done_event.set()
+
+    def _get_prompt_scaffold(self) -> tuple:
+        """
+        返回用户提示中固定的前缀（角色设定/参考资料）和后缀（输出要求）
+
+        档位、对话记录或知识库变化时才重新拼接，其余轮次直接复用。
+        """
+        key = (self.student_profile_key, self.reference_dialogue_content, self.knowledge_base_content)
+        if key == self._prompt_scaffold_key:
+            return self._prompt_scaffold
+
+        # 获取学生档位信息
+        profile_info = STUDENT_PROFILES.get(self.student_profile_key, STUDENT_PROFILES["medium"])
+
+        sections = [
+            "## 角色设定",
+            f"学生档位: {profile_info['label']}",
+            f"角色特征: {profile_info['description']}",
+            f"表达风格: {profile_info['style']}",
+            "",
+            "## 问题类型识别（优先级最高）",
+            "如果当前问题属于以下类型，请优先直接回答，不需要强制体现性格特点：",
+            "1. **确认式问题**: 如'你准备好了吗？请回复是或否'",
+            self.lang_config["confirm_examples"],
+            "2. **选择式问题**: 如'你选择A还是B？'、'请选择1/2/3'",
+            self.lang_config["choice_examples"],
+            "",
+        ]
+
+        if self.reference_dialogue_content:
+            sections.extend([
+                "## 优先级最高：参考对话记录（如有匹配请优先引用或改写）",
+                self.reference_dialogue_content,
+                "",
+            ])
+
+        if self.knowledge_base_content:
+            sections.extend([
+                "## 次优先级：参考知识库（对话记录无匹配时优先依据知识库）",
+                self.knowledge_base_content,
+                "",
+            ])
+
+        suffix = "\n".join([
+            "",
+            "",
+            "## 输出要求（按优先级执行）",
+            "**优先级1**: 如果对话记录中存在语义高度相关回答，优先引用或改写其结论和表达风格",
+            "**优先级2**: 对话记录无匹配时，优先依据知识库作答，不要编造不存在的信息",
+            "**优先级3**: 若前两者都不足，再结合学生档位特征回答；封闭式问题保持简短直接",
+            self.lang_config["format_requirement"],
+            ""
+        ])
+
+        self._prompt_scaffold_key = key
+        self._prompt_scaffold = ("\n".join(sections) + "\n", suffix)
+        return self._prompt_scaffold
+
     def _append_conversation_history(self, ai_text: str, student_text: str):
         self.conversation_history.append({
             "ai": ai_text,
             "student": student_text,
         })
-        if len(self.conversation_history) > 10:
-            self.conversation_history = self.conversation_history[-10:]
 
     def _read_text_file(self, path: Path) -> str:
         return path.read_text(encoding="utf-8")
@@ -663,30 +1186,72 @@ class TrainingClient:
             return False
     
     async def connect(self):
-        url = f"{CONFIG['ws_url']}?taskId={CONFIG['task_id']}"
-        headers = {
-            "Origin": "https://hike-teaching-center.polymas.com",
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36",
-        }
-        
+        # PCM 音频几乎不可压缩，关闭 permessage-deflate 省去每帧的 zlib 开销；
+        # max_size=None 避免较大的 bot 回复帧被拒收，write_limit 调大让音频帧写入缓冲后即可返回
         self.ws = await websockets.connect(
-            url, additional_headers=headers, proxy=None,
-            ping_interval=20, ping_timeout=10
+            self._ws_url, additional_headers=WS_HEADERS, proxy=None,
+            ping_interval=20, ping_timeout=10, compression=None,
+            max_size=None, write_limit=2 ** 20
         )
         self.is_connected = True
+        self._writer_task = asyncio.create_task(self._writer_loop())
         log.info("✅ WebSocket连接成功")
     
     async def disconnect(self):
+        if self._writer_task:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            self._writer_task = None
+        while self._send_queue:
+            _, future = self._send_queue.popleft()
+            if not future.done():
+                future.set_exception(RuntimeError("WebSocket 已断开"))
         if self.ws:
             await self.ws.close()
         self.is_connected = False
+        self.logger.close()
         log.info("连接已断开")
+
+    def _enqueue_send(self, data) -> asyncio.Future:
+        """把待发送数据交给写者任务，返回发送完成时 resolve 的 Future"""
+        if self._writer_task is None or self._writer_task.done():
+            raise RuntimeError("WebSocket 未连接")
+        future = asyncio.get_running_loop().create_future()
+        self._send_queue.append((data, future))
+        waker = self._send_waker
+        if waker is not None and not waker.done():
+            waker.set_result(None)
+        return future
+
+    async def _writer_loop(self):
+        """唯一调用 ws.send 的任务：按入队顺序逐条发送"""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._send_queue:
+                self._send_waker = loop.create_future()
+                await self._send_waker
+                continue
+
+            data, future = self._send_queue.popleft()
+            if future.done():  # 发送方已取消
+                continue
+            try:
+                await self.ws.send(data)
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+            else:
+                self._last_send_ts = loop.time()
+                if not future.done():
+                    future.set_result(None)
     
-    async def send_json(self, event: str, payload: dict):
-        msg = json.dumps({"event": event, "payload": payload})
+    async def send_json(self, event: str, payload: dict, log_level: int = logging.INFO):
+        msg = _json_dumps({"event": event, "payload": payload})
         async with self._ws_send_lock:
-            await self.ws.send(msg)
-        log.info(f"📤 {event}: {json.dumps(payload, ensure_ascii=False)}")
+            await self._enqueue_send(msg)
+        # 日志用的可读 JSON 仅在该级别实际输出时才序列化
+        if log.isEnabledFor(log_level):
+            log.log(log_level, "📤 %s: %s", event, json.dumps(payload, ensure_ascii=False))
     
     async def start_script(self):
         await self.send_json("startScript", {
@@ -702,7 +1267,9 @@ class TrainingClient:
         await self.send_json("nextStep", {"stepId": step_id})
     
     async def send_heartbeat(self):
-        await self.send_json("heartBeat", {})
+        await self.send_json(
+            "heartBeat", {}, log_level=logging.INFO if self.heartbeat_log else logging.DEBUG
+        )
     
     def _request_stop_audio_sending(self, reason: str):
         stop_event = self._audio_stop_event
@@ -711,40 +1278,87 @@ class TrainingClient:
             log.info(f"🛑 停止发送音频: {reason}")
 
     async def send_audio_frames(self, pcm_data: bytes):
+        chunk_size = AUDIO_CONFIG["pcm_chunk_size"]
+        audio_frame_count = (len(pcm_data) + chunk_size - 1) // chunk_size
+
+        log.info(f"📤 发送: {audio_frame_count} 音频帧 + {AUDIO_CONFIG['silence_frames']} 静音帧(最多)")
+
+        # 语音内容帧 + 静音帧一次性构建好（允许提前停止）
+        await self._send_frame_stream(self.audio.create_frames(pcm_data))
+
+    async def send_audio_stream(self, pcm_chunks: AsyncIterator[bytes]):
+        """边接收 PCM 边分帧发送（流式 TTS）"""
+        log.info(f"📤 流式发送音频帧 + {AUDIO_CONFIG['silence_frames']} 静音帧(最多)")
+        await self._send_frame_stream(self.audio.stream_frames(pcm_chunks))
+
+    async def _send_frame_stream(self, frames):
+        """按节拍发送帧；frames 可以是普通可迭代对象或异步迭代器"""
         # 为本次发送创建 stop 事件（用于提前终止）
         self._audio_stop_event = asyncio.Event()
         stop_event = self._audio_stop_event
 
         self._audio_sending = True
         self._audio_sending_done.clear()
+        self._audio_frames_sent = 0
 
-        chunk_size = AUDIO_CONFIG["pcm_chunk_size"]
-        audio_frame_count = int(math.ceil(len(pcm_data) / chunk_size)) if pcm_data else 0
+        if not hasattr(frames, "__aiter__"):
+            frames = _aiter(frames)
 
-        log.info(f"📤 发送: {audio_frame_count} 音频帧 + {AUDIO_CONFIG['silence_frames']} 静音帧(最多)")
+        loop = asyncio.get_running_loop()
+        interval = AUDIO_CONFIG["chunk_interval"]
+        frames_per_send = AUDIO_CONFIG["frames_per_send"]
+        max_pending_sends = AUDIO_CONFIG["max_pending_sends"]
+        pending_sends: deque = deque()
+        batch: List[bytes] = []
 
         try:
-            async with self._ws_send_lock:
-                # 先发送语音内容帧
-                for i in range(0, len(pcm_data), chunk_size):
-                    if not self.is_connected or stop_event.is_set():
-                        break
+            # 按绝对时间点节拍发送，sleep 抖动不会累积；发送与等待重叠进行
+            started_at = None
+            index = 0
+            async for frame in frames:
+                if not self.is_connected or stop_event.is_set():
+                    break
 
-                    pcm_chunk = pcm_data[i:i + chunk_size]
-                    await self.ws.send(self.audio.create_frame(pcm_chunk))
-                    await asyncio.sleep(AUDIO_CONFIG["chunk_interval"])
+                # 以首帧到达时刻为节拍起点；流式 TTS 卡顿使帧晚到超过一个节拍时重新对齐，
+                # 否则之后的节拍点都已过期，积压的帧会不经节拍一次性发出
+                now = loop.time()
+                if started_at is None or now - (started_at + index * interval) > interval:
+                    started_at = now - index * interval
+                index += 1
+                if frames_per_send > 1:
+                    batch.append(frame)
+                    if len(batch) < frames_per_send:
+                        continue
+                    frame = b"".join(batch)
+                    batch.clear()
 
-                # 再发送静音帧（允许提前停止）
-                for _ in range(AUDIO_CONFIG["silence_frames"]):
-                    if not self.is_connected or stop_event.is_set():
-                        break
+                # 只在入队这一刻持锁：控制消息可在帧间插入，而不必等整段语音发完
+                async with self._ws_send_lock:
+                    pending_sends.append(self._enqueue_send(frame))
+                self._audio_frames_sent = index
+                if len(pending_sends) >= max_pending_sends:
+                    await pending_sends.popleft()
 
-                    await self.ws.send(self.audio.create_silence_frame())
-                    await asyncio.sleep(AUDIO_CONFIG["chunk_interval"])
+                delay = started_at + index * interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            # 不足一批的剩余帧（中途停止时丢弃）
+            if batch and self.is_connected and not stop_event.is_set():
+                async with self._ws_send_lock:
+                    pending_sends.append(self._enqueue_send(b"".join(batch)))
+                self._audio_frames_sent = index
+
+            while pending_sends:
+                await pending_sends.popleft()
 
         finally:
+            for send_task in pending_sends:
+                send_task.cancel()
             self._audio_sending = False
             self._audio_sending_done.set()
+            # 提前 break 时立即关闭帧来源（连同上游的 TTS 流），不留给 GC
+            await frames.aclose()
             log.info("✅ 音频发送完成")
 
     def _call_doubao_post(self, messages, temperature=0.7, max_tokens=1000):
@@ -778,7 +1392,7 @@ class TrainingClient:
         }
 
         try:
-            response = requests.post(
+            response = http_session.post(
                 self.llm_api_url,
                 headers=headers,
                 json=payload,
@@ -794,7 +1408,7 @@ class TrainingClient:
             log.error(f"❌ 解析响应失败: {str(e)}")
             return None
 
-    def generate_ai_answer(self, bot_question: str) -> str:
+    async def generate_ai_answer(self, bot_question: str) -> str:
         """
         使用 Doubao API 生成学生回答
 
@@ -809,53 +1423,25 @@ class TrainingClient:
             return self.lang_config["fallback_answer"]
 
         try:
+            recent_history = list(self.conversation_history)[-5:]  # 只保留最近5轮
             log.info(
                 "🧠 本轮上下文: 对话记录=%s, 知识库=%s, 当前会话历史=%s轮",
                 "启用" if self.reference_dialogue_content else "关闭",
                 "启用" if self.knowledge_base_content else "关闭",
-                len(self.conversation_history[-5:]),
+                len(recent_history),
             )
 
-            # 获取学生档位信息
-            profile_info = STUDENT_PROFILES.get(self.student_profile_key, STUDENT_PROFILES["medium"])
-
             # 构建系统提示
             system_prompt = self.lang_config["system_prompt"]
 
-            # 构建用户提示
-            sections = [
-                "## 角色设定",
-                f"学生档位: {profile_info['label']}",
-                f"角色特征: {profile_info['description']}",
-                f"表达风格: {profile_info['style']}",
-                "",
-                "## 问题类型识别（优先级最高）",
-                "如果当前问题属于以下类型，请优先直接回答，不需要强制体现性格特点：",
-                "1. **确认式问题**: 如'你准备好了吗？请回复是或否'",
-                self.lang_config["confirm_examples"],
-                "2. **选择式问题**: 如'你选择A还是B？'、'请选择1/2/3'",
-                self.lang_config["choice_examples"],
-                "",
-            ]
-
-            if self.reference_dialogue_content:
-                sections.extend([
-                    "## 优先级最高：参考对话记录（如有匹配请优先引用或改写）",
-                    self.reference_dialogue_content,
-                    "",
-                ])
-
-            if self.knowledge_base_content:
-                sections.extend([
-                    "## 次优先级：参考知识库（对话记录无匹配时优先依据知识库）",
-                    self.knowledge_base_content,
-                    "",
-                ])
+            # 构建用户提示：固定部分取缓存，只拼接会话历史和当前问题
+            prefix, suffix = self._get_prompt_scaffold()
+            sections = []
 
             # 添加当前会话历史（最近5轮）
-            if self.conversation_history:
+            if recent_history:
                 sections.append("## 对话历史（按时间顺序）")
-                for i, turn in enumerate(self.conversation_history[-5:], 1):  # 只保留最近5轮
+                for i, turn in enumerate(recent_history, 1):
                     sections.append(f"第{i}轮:")
                     sections.append(f"  AI提问: {turn['ai']}")
                     sections.append(f"  学生回答: {turn['student']}")
@@ -864,25 +1450,20 @@ class TrainingClient:
             sections.extend([
                 "## 当前问题",
                 bot_question,
-                "",
-                "## 输出要求（按优先级执行）",
-                "**优先级1**: 如果对话记录中存在语义高度相关回答，优先引用或改写其结论和表达风格",
-                "**优先级2**: 对话记录无匹配时，优先依据知识库作答，不要编造不存在的信息",
-                "**优先级3**: 若前两者都不足，再结合学生档位特征回答；封闭式问题保持简短直接",
-                self.lang_config["format_requirement"],
-                ""
             ])
 
-            user_message = "\n".join(sections)
+            user_message = prefix + "\n".join(sections) + suffix
 
             messages = [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message}
             ]
 
-            # 调用 Doubao API
+            # 调用 Doubao API（同步 HTTP 放到线程中，避免阻塞 WebSocket 收发）
             log.info("🔄 使用 Doubao POST API 生成回答...")
-            answer = self._call_doubao_post(messages, temperature=0.7, max_tokens=200)
+            answer = await asyncio.to_thread(
+                self._call_doubao_post, messages, temperature=0.7, max_tokens=200
+            )
 
             if answer:
                 return answer
@@ -897,18 +1478,35 @@ class TrainingClient:
         self.last_sent_text = text  # 记录发送内容，用于重试
         log.info(f"🎤 准备发送: {text}")
         
-        while self.bot_speaking:
-            await asyncio.sleep(0.1)
+        await self._bot_idle_event.wait()
 
         # 等待服务器完成状态转换（ASR 管道就绪），避免首次发送被吞
         await asyncio.sleep(0.5)
 
+        if self.tts.prefers_edge and self.audio.can_stream_mp3:
+            try:
+                log.info("🔄 流式生成语音...")
+                self.waiting_response = True
+                await self.send_audio_stream(
+                    self.audio.stream_mp3_to_pcm(self.tts.stream_with_edge(text))
+                )
+                log.info("⏳ 等待响应...")
+                return True
+            except Exception as e:
+                self.waiting_response = False
+                if self._audio_frames_sent:
+                    # 已有音频发出，无法无缝回退
+                    log.error(f"❌ 流式发送中断: {e}")
+                    return False
+                log.warning(f"⚠️ 流式 TTS 失败，回退到完整合成: {e}")
+
         try:
             log.info("🔄 生成语音...")
             mp3_data = await self.tts.synthesize(text)
             log.info(f"✅ MP3: {len(mp3_data)} bytes")
             
-            pcm_data = self.audio.mp3_to_pcm(mp3_data)
+            # 解码/重采样是阻塞操作，放到线程中执行，避免卡住 WebSocket 消息处理
+            pcm_data = await asyncio.to_thread(self.audio.mp3_to_pcm, mp3_data)
             log.info(f"✅ PCM: {len(pcm_data)} bytes")
             
             self.waiting_response = True
@@ -925,151 +1523,166 @@ class TrainingClient:
             return False
     
     async def handle_message(self, message):
-        if isinstance(message, bytes):
+        # 只处理文本帧；服务端的事件都是 JSON 对象，非 "{" 开头的直接丢弃，不再尝试解析
+        if type(message) is not str or not message or message[0] != "{":
             return
-        
+
         try:
-            data = json.loads(message)
+            data = _json_loads(message)
             event = data.get("event")
             payload = data.get("payload", {})
-            
-            if event == "connected":
-                self.session_id = payload.get("sessionId")
-                self.step_id = payload.get("stepId")
-                self.step_name = payload.get("stepName")
-                log.info(f"📱 会话: {self.session_id}")
-                log.info(f"📍 步骤: {self.step_name} ({self.step_id})")
-                self.step_just_started = True  # 标记新步骤开始
-                await self.start_script()
-                
-            elif event == "botAnswerStart":
-                self.bot_speaking = True
-                self.current_bot_msg = ""
-                # 注意：不要在这里设置 waiting_response = False
-                # 应该等到 botAnswerEnd 时才认为响应完成，确保 current_bot_msg 已完整接收
-                self.heartbeat_without_response = 0  # 重置心跳计数
-                self._request_stop_audio_sending("botAnswerStart")
-                now = time.monotonic()
-                self.bot_answer_started_at = now
-                self.last_bot_activity_at = now
-                log.info("🤖 Bot开始回复...")
-
-            elif event == "botAnswer":
-                msg = payload.get("msg", "")
-                self.current_history_id = payload.get("historyId", "")
-                self.current_bot_msg += msg
-                self.last_bot_activity_at = time.monotonic()
-                
-            elif event == "botAnswerEnd":
-                if self.current_bot_msg:
-                    # 确定来源
-                    source = "runCard" if self.step_just_started else "chat"
-
-                    # 记录日志
-                    self.logger.log(
-                        role="AI",
-                        content=self.current_bot_msg,
-                        step_name=self.step_name,
-                        step_id=self.step_id,
-                        round_num=self.round_counter,
-                        source=source,
-                        user_content=self.pending_user_message if source == "chat" else None
-                    )
 
-                    # 重置 step_just_started 标志
-                    if self.step_just_started:
-                        self.step_just_started = False
+            handler = self._event_handlers.get(event)
+            if handler is not None:
+                await handler(payload)
+        except json.JSONDecodeError:  # orjson.JSONDecodeError 也是其子类
+            pass
+    
+    async def _on_connected(self, payload: dict):
+        self.session_id = payload.get("sessionId")
+        self.step_id = payload.get("stepId")
+        self.step_name = payload.get("stepName")
+        log.info(f"📱 会话: {self.session_id}")
+        log.info(f"📍 步骤: {self.step_name} ({self.step_id})")
+        self.step_just_started = True  # 标记新步骤开始
+        await self.start_script()
+
+    async def _on_bot_answer_start(self, payload: dict):
+        self.bot_speaking = True
+        self.current_bot_msg = ""
+        self._bot_chunks.clear()
+        self.current_history_id = ""
+        # 注意：不要在这里设置 waiting_response = False
+        # 应该等到 botAnswerEnd 时才认为响应完成，确保 current_bot_msg 已完整接收
+        self.heartbeat_without_response = 0  # 重置心跳计数
+        self._request_stop_audio_sending("botAnswerStart")
+        now = time.monotonic()
+        self.bot_answer_started_at = now
+        self.last_bot_activity_at = now
+        log.info("🤖 Bot开始回复...")
+
+    async def _on_bot_answer(self, payload: dict):
+        # historyId 在同一轮回复内不变，只在首个分片时读取
+        if not self.current_history_id:
+            self.current_history_id = payload.get("historyId", "")
+        self._bot_chunks.append(payload.get("msg", ""))
+        self.last_bot_activity_at = time.monotonic()
+
+    def _join_bot_chunks(self):
+        """把已收到的 botAnswer 分片拼接到 current_bot_msg（避免逐片 += 的重复拷贝）"""
+        if self._bot_chunks:
+            self.current_bot_msg += "".join(self._bot_chunks)
+            self._bot_chunks.clear()
+
+    async def _on_bot_answer_end(self, payload: dict):
+        self._join_bot_chunks()
+        if self.current_bot_msg:
+            # 确定来源
+            source = "runCard" if self.step_just_started else "chat"
+
+            # 记录日志
+            self.logger.log(
+                role="AI",
+                content=self.current_bot_msg,
+                step_name=self.step_name,
+                step_id=self.step_id,
+                round_num=self.round_counter,
+                source=source,
+                user_content=self.pending_user_message if source == "chat" else None
+            )
 
-                    # 清空缓存的用户消息
-                    self.pending_user_message = None
+            # 重置 step_just_started 标志
+            if self.step_just_started:
+                self.step_just_started = False
 
-                    # 保留 current_bot_msg 不清空，供半交互模式的 AI 生成回答使用
-                    # 在 botAnswerStart 时会重新清空
+            # 清空缓存的用户消息
+            self.pending_user_message = None
 
-                self.bot_speaking = False
-                self.waiting_response = False
-                self.heartbeat_without_response = 0  # 重置心跳计数
-                self.bot_answer_started_at = None
-                self.last_bot_activity_at = time.monotonic()
+            # 保留 current_bot_msg 不清空，供半交互模式的 AI 生成回答使用
+            # 在 botAnswerStart 时会重新清空
 
-            elif event == "userTextStart":
-                log.info("🎙️ ✅ 开始识别!")
-                
-            elif event == "userText":
-                log.info(f"🎙️ 识别: {payload.get('text')}")
-                
-            elif event == "userTextEnd":
-                text = payload.get("text", "")
+        self.bot_speaking = False
+        self.waiting_response = False
+        self.heartbeat_without_response = 0  # 重置心跳计数
+        self.bot_answer_started_at = None
+        self.last_bot_activity_at = time.monotonic()
 
-                # 轮次计数增加
-                self.round_counter += 1
+    async def _on_user_text_start(self, payload: dict):
+        log.info("🎙️ ✅ 开始识别!")
 
-                # 缓存用户消息，等待与AI回复一起记录
-                self.pending_user_message = text
+    async def _on_user_text(self, payload: dict):
+        log.info(f"🎙️ 识别: {payload.get('text')}")
 
-                log.info(f"✅ 识别完成: {text}")
-                
-            elif event == "userAudioEnd":
-                log.info("🔗 音频已保存")
-                self._request_stop_audio_sending("userAudioEnd")
-                
-            elif event == "stepEnd":
-                # 关键：收到 stepEnd，从中获取 nextStepId
-                current_step = payload.get("stepName", "")
-                next_step_id = payload.get("nextStepId")
-                next_step_name = payload.get("nextStepName", "")  # 尝试获取下一步骤名称
-                end_type = payload.get("endType", "")
-                step_desc = payload.get("stepDescription", "")
-
-                # step 结束说明服务器已经不再需要当前音频流，停止继续发送避免跨步骤触发识别
-                self._request_stop_audio_sending("stepEnd")
-
-                log.info(f"📍 步骤结束: {current_step}")
-                log.info(f"   结束类型: {end_type}")
-                log.info(f"   步骤描述: {step_desc[:50]}...")
-
-                if next_step_id:
-                    log.info(f"➡️ 下一步: {next_step_id}")
-                    self.step_id = next_step_id
-
-                    # 更新步骤名称（如果服务器没有返回，用step_id作为临时名称）
-                    if next_step_name:
-                        self.step_name = next_step_name
-                    else:
-                        self.step_name = current_step
+    async def _on_user_text_end(self, payload: dict):
+        text = payload.get("text", "")
 
-                    # 轮次计数器不重置，持续累加
+        # 轮次计数增加
+        self.round_counter += 1
 
-                    # 标记新步骤开始
-                    self.step_just_started = True
+        # 缓存用户消息，等待与AI回复一起记录
+        self.pending_user_message = text
 
-                    # 清空缓存的用户消息（跨步骤不携带）
-                    self.pending_user_message = None
+        log.info(f"✅ 识别完成: {text}")
+
+    async def _on_user_audio_end(self, payload: dict):
+        log.info("🔗 音频已保存")
+        self._request_stop_audio_sending("userAudioEnd")
+
+    async def _on_step_end(self, payload: dict):
+        # 关键：收到 stepEnd，从中获取 nextStepId
+        current_step = payload.get("stepName", "")
+        next_step_id = payload.get("nextStepId")
+        next_step_name = payload.get("nextStepName", "")  # 尝试获取下一步骤名称
+        end_type = payload.get("endType", "")
+        step_desc = payload.get("stepDescription", "")
+
+        # step 结束说明服务器已经不再需要当前音频流，停止继续发送避免跨步骤触发识别
+        self._request_stop_audio_sending("stepEnd")
+
+        log.info(f"📍 步骤结束: {current_step}")
+        log.info(f"   结束类型: {end_type}")
+        log.info(f"   步骤描述: {step_desc[:50]}...")
+
+        if next_step_id:
+            log.info(f"➡️ 下一步: {next_step_id}")
+            self.step_id = next_step_id
+
+            # 更新步骤名称（如果服务器没有返回，用step_id作为临时名称）
+            if next_step_name:
+                self.step_name = next_step_name
+            else:
+                self.step_name = current_step
+
+            # 轮次计数器不重置，持续累加
+
+            # 标记新步骤开始
+            self.step_just_started = True
+
+            # 清空缓存的用户消息（跨步骤不携带）
+            self.pending_user_message = None
+
+            # 发送 nextStep 确认（等待音频发送结束后再发，避免音频串到下一步触发再次识别）
+            if self._next_step_task and not self._next_step_task.done():
+                self._next_step_task.cancel()
+            self._next_step_task = asyncio.create_task(self._send_next_step_safely(next_step_id))
+        else:
+            log.info("🏁 任务完成，没有下一步了！")
+            self.task_completed = True
+
+    async def _on_task_end(self, payload: dict):
+        log.info("🎉 整个任务已完成！")
+        self.task_completed = True
+        self.waiting_response = False
+        self._request_stop_audio_sending("taskEnd")
+
+    async def _on_error(self, payload: dict):
+        log.error(f"❌ 错误: {payload}")
+        self._join_bot_chunks()  # 保留已收到的部分回复
+        # 出错时尽量解锁等待状态，避免永远卡在 bot_speaking
+        self.bot_speaking = False
+        self.bot_answer_started_at = None
+        self.last_bot_activity_at = time.monotonic()
 
-                    # 发送 nextStep 确认（等待音频发送结束后再发，避免音频串到下一步触发再次识别）
-                    if self._next_step_task and not self._next_step_task.done():
-                        self._next_step_task.cancel()
-                    self._next_step_task = asyncio.create_task(self._send_next_step_safely(next_step_id))
-                else:
-                    log.info("🏁 任务完成，没有下一步了！")
-                    self.task_completed = True
-                
-            elif event == "taskEnd":
-                log.info("🎉 整个任务已完成！")
-                self.task_completed = True
-                self.waiting_response = False
-                self._request_stop_audio_sending("taskEnd")
-                
-            elif event == "error":
-                log.error(f"❌ 错误: {payload}")
-                # 出错时尽量解锁等待状态，避免永远卡在 bot_speaking
-                self.bot_speaking = False
-                self.bot_answer_started_at = None
-                self.last_bot_activity_at = time.monotonic()
-                
-        except json.JSONDecodeError:
-            pass
-    
     async def listen_loop(self):
         try:
             async for message in self.ws:
@@ -1097,7 +1710,11 @@ class TrainingClient:
             start_wait = time.monotonic()
 
             while True:
-                await asyncio.sleep(0.5)
+                # 响应完成时立即醒来；否则每 0.5 秒检查一次超时/卡住状态
+                try:
+                    await asyncio.wait_for(self._response_done_event.wait(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    pass
 
                 # 响应已完成（botAnswerEnd 触发）
                 if not self.waiting_response:
@@ -1110,10 +1727,12 @@ class TrainingClient:
                     if self.last_bot_activity_at and (now - self.last_bot_activity_at) >= self.bot_idle_timeout:
                         log.warning(f"⚠️ Bot 已 {int(now - self.last_bot_activity_at)} 秒无输出，判定卡住")
                         self.bot_speaking = False
+                        self._join_bot_chunks()  # 保留已收到的部分回复
                         break
                     if self.bot_answer_started_at and (now - self.bot_answer_started_at) >= self.bot_total_timeout:
                         log.warning(f"⚠️ Bot 回复超过 {int(now - self.bot_answer_started_at)} 秒仍未结束，判定卡住")
                         self.bot_speaking = False
+                        self._join_bot_chunks()  # 保留已收到的部分回复
                         break
                     continue
 
@@ -1137,21 +1756,31 @@ class TrainingClient:
         return False
 
     async def heartbeat_loop(self):
+        loop = asyncio.get_running_loop()
         while self.is_connected:
-            await asyncio.sleep(30)
+            await asyncio.sleep(self.heartbeat_interval)
             if self.is_connected:
                 try:
-                    await self.send_heartbeat()
+                    # 最近刚发送过数据（如音频流）时连接本身就是活跃的，跳过这次心跳
+                    if loop.time() - self._last_send_ts > self.heartbeat_idle_threshold:
+                        await self.send_heartbeat()
                     # 监控无响应的心跳次数
                     if self.waiting_response:
                         self.heartbeat_without_response += 1
                         if self.heartbeat_without_response >= 3:  # 90秒无响应
-                            log.warning(f"⚠️ 服务器已 {self.heartbeat_without_response * 30} 秒无响应")
+                            log.warning(
+                                f"⚠️ 服务器已 {self.heartbeat_without_response * self.heartbeat_interval} 秒无响应"
+                            )
                     else:
                         self.heartbeat_without_response = 0
                 except (websockets.ConnectionClosed, OSError, RuntimeError) as err:
                     log.warning(f"⚠️ 心跳发送失败: {err}")
 
+    async def _record_and_speak(self, student_text: str) -> bool:
+        """保存本轮对话历史并发送学生回答"""
+        self._append_conversation_history(self.current_bot_msg, student_text)
+        return await self.speak(student_text)
+
     async def semi_interactive_mode(self):
         """
         半交互模式：
@@ -1160,41 +1789,22 @@ class TrainingClient:
         - continue = 切换到全自动模式
         - quit = 退出
         """
-        print("\n" + "="*60)
-        print("📢 半交互模式")
-        print("="*60)
-        print("说明：")
-        print("  - [回车] AI 自动生成回答")
-        print("  - [输入文字] 使用你的回答")
-        print("  - [continue] 切换到全自动模式")
-        print("  - [quit] 退出")
-        print("="*60 + "\n")
+        sys.stdout.write(_SEMI_MODE_BANNER)
+        sys.stdout.flush()
 
         while self.is_connected and not self.task_completed:
             try:
+                student_text = None  # None 表示本轮由 AI 生成回答
                 if self.auto_continue:
                     # 全自动模式：直接生成AI回答
                     print("\n🤖 [全自动模式] 正在生成AI回答...")
                     await asyncio.sleep(1)  # 稍等一下让用户看到 Bot 消息
-
-                    # 生成 AI 回答
-                    ai_answer = self.generate_ai_answer(self.current_bot_msg)
-                    print(f"🤖 AI: {ai_answer}")
-
-                    # 保存对话历史
-                    self._append_conversation_history(self.current_bot_msg, ai_answer)
-
-                    speak_ok = await self.speak(ai_answer)
                 else:
                     # 半交互模式：等待用户输入
-                    print("\n" + "-" * 60)
-                    print("💬 请输入回答:")
-                    print("   [回车] AI 生成 | [输入文字] 手动 | [continue] 全自动 | [quit] 退出")
-                    print("-" * 60)
+                    sys.stdout.write(_SEMI_PROMPT_BANNER)
+                    sys.stdout.flush()
 
-                    user_input = await asyncio.get_event_loop().run_in_executor(
-                        None, input, ">> "
-                    )
+                    user_input = await ainput(">> ")
 
                     user_input = user_input.strip()
 
@@ -1203,34 +1813,22 @@ class TrainingClient:
                         break
 
                     if user_input.lower() == 'continue':
+                        # 切换到全自动模式，本轮也自动回答
                         print("\n🚀 切换到全自动模式...")
                         self.auto_continue = True
-                        # 本轮也自动回答
-                        ai_answer = self.generate_ai_answer(self.current_bot_msg)
-                        print(f"🤖 AI: {ai_answer}")
-
-                        # 保存对话历史
-                        self._append_conversation_history(self.current_bot_msg, ai_answer)
-
-                        speak_ok = await self.speak(ai_answer)
                     elif user_input == "":
                         # 回车：使用 AI 生成
                         print("\n🤖 正在生成AI回答...")
-                        ai_answer = self.generate_ai_answer(self.current_bot_msg)
-                        print(f"🤖 AI: {ai_answer}")
-
-                        # 保存对话历史
-                        self._append_conversation_history(self.current_bot_msg, ai_answer)
-
-                        speak_ok = await self.speak(ai_answer)
                     else:
                         # 用户手动输入
                         print(f"\n👤 用户: {user_input}")
+                        student_text = user_input
 
-                        # 保存对话历史
-                        self._append_conversation_history(self.current_bot_msg, user_input)
+                if student_text is None:
+                    student_text = await self.generate_ai_answer(self.current_bot_msg)
+                    print(f"🤖 AI: {student_text}")
 
-                        speak_ok = await self.speak(user_input)
+                speak_ok = await self._record_and_speak(student_text)
 
                 if not speak_ok:
                     log.warning("⚠️ 本轮 TTS 失败，跳过并继续下一轮")
@@ -1257,9 +1855,7 @@ class TrainingClient:
         
         while self.is_connected and not self.task_completed:
             try:
-                user_input = await asyncio.get_event_loop().run_in_executor(
-                    None, input, "💬 输入: "
-                )
+                user_input = await ainput("💬 输入: ")
                 
                 if user_input.lower() == 'quit':
                     break
@@ -1314,13 +1910,14 @@ async def main():
     print("="*60)
     print("\n正在获取用户信息...")
 
-    user_id, school_id = get_user_info()
-    CONFIG["user_id"] = user_id
-    CONFIG["school_id"] = school_id
+    # 环境变量缺失可以立即发现，先同步检查，不必等用户回答完选项才报错
+    headers = get_auth_headers()
 
-    print(f"✅ 用户ID: {user_id}")
-    print(f"✅ 学校ID: {school_id}")
-    print(f"✅ 任务ID: {CONFIG['task_id']}")
+    # 只把 HTTPS 请求提交到后台线程，与下面的选项输入重叠，创建客户端前再等待结果；
+    # 后台线程不打印，错误在等待结果时统一提示，不会与选项输入交错。
+    # 注意：下面的 input() 会阻塞事件循环，所以必须用 run_in_executor 立即提交，
+    # asyncio.to_thread 包装成任务要等事件循环下次调度才会真正启动。
+    user_info_task = asyncio.get_running_loop().run_in_executor(None, fetch_user_info, headers)
 
     print("\n流程:")
     print("  1. 用户发送音频")
@@ -1351,6 +1948,17 @@ async def main():
     mode_choice = input("\n请输入选项 (1/2，默认 1): ").strip()
     # mode_choice = "1"
 
+    try:
+        user_id, school_id = await user_info_task
+    except Exception as e:
+        report_user_info_error(e)
+    CONFIG["user_id"] = user_id
+    CONFIG["school_id"] = school_id
+
+    print(f"\n✅ 用户ID: {user_id}")
+    print(f"✅ 学校ID: {school_id}")
+    print(f"✅ 任务ID: {CONFIG['task_id']}")
+
     client = TrainingClient(lang=selected_lang)
 
     # 如果选择半交互模式，让用户选择学生档位
@@ -1404,5 +2012,30 @@ async def main():
         await client.run(mode='semi')
 
 
-if __name__ == "__main__":
+def _uvloop_factory():
+    """可选：返回 uvloop 的事件循环工厂（Windows 不支持，未安装时返回 None 使用默认循环）"""
+    if sys.platform == "win32":
+        return None
+    try:
+        import uvloop
+    except ImportError:
+        return None
+    log.info("⚡ 已启用 uvloop 事件循环")
+    return uvloop.new_event_loop
+
+
+def run_main():
+    loop_factory = _uvloop_factory()
+    if loop_factory is not None and sys.version_info >= (3, 11):
+        # 只为本次运行创建 uvloop 循环，不改动全局事件循环策略
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            runner.run(main())
+        return
+    if loop_factory is not None:
+        import uvloop
+        uvloop.install()
     asyncio.run(main())
+
+
+if __name__ == "__main__":
+    run_main()
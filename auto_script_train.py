@@ -3,8 +3,10 @@ import json
 import time
 import os
 import difflib
+import importlib.util
 import math
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from openai import OpenAI
@@ -649,7 +651,7 @@ class WorkflowTester(WorkflowTesterBase):
         # Provide profile data for base prompt/selection helpers.
         self.student_profiles = self.STUDENT_PROFILES
 
-        # 重试配置
+        # 重试配置（重试逻辑见 WorkflowTesterBase._retry_request）
         self.max_retries = 3  # 最大重试次数
         self.base_timeout = 60  # 基础超时时间（秒）
         self.retry_backoff = 2  # 重试退避因子
@@ -668,6 +670,10 @@ class WorkflowTester(WorkflowTesterBase):
         self.llm_model = os.getenv("LLM_MODEL", "Doubao-1.5-pro-32k")
         self.llm_service_code = os.getenv("LLM_SERVICE_CODE", "SI_Ability")
 
+        # 多候选采样配置：每轮并发生成 N 个候选回答并投票选出最一致的一个（1 表示不采样）
+        self.doubao_candidates = max(1, int(os.getenv("DOUBAO_CANDIDATES", "1")))
+        self.doubao_max_concurrency = max(1, int(os.getenv("DOUBAO_MAX_CONCURRENCY", "10")))
+
         # 回放模式相关属性
         self.replay_engine = None
         self.use_replay_mode = False
@@ -694,7 +700,16 @@ class WorkflowTester(WorkflowTesterBase):
 
             if api_key:
                 try:
-                    self.doubao_client = OpenAI(api_key=api_key, base_url=base_url)
+                    import httpx
+
+                    # 多轮调用共用一个连接池；安装了 h2 时启用 HTTP/2
+                    http_client = httpx.Client(
+                        http2=importlib.util.find_spec("h2") is not None,
+                        timeout=httpx.Timeout(120.0, connect=10.0),
+                    )
+                    self.doubao_client = OpenAI(
+                        api_key=api_key, base_url=base_url, http_client=http_client
+                    )
                     print(f"   - 使用 Doubao OpenAI SDK 调用模式")
                     print(f"   - Model: {self.doubao_model}")
                 except Exception as e:
@@ -704,7 +719,7 @@ class WorkflowTester(WorkflowTesterBase):
         else:
             print(f"⚠️  警告: 未知的模型类型: {self.model_type}")
 
-    def _call_doubao_post(self, messages, temperature=0.7, max_tokens=1000):
+    def _call_doubao_post(self, messages, temperature=0.7, max_tokens=1000, session=None):
         """使用 HTTP POST 方式调用 Doubao API"""
         headers = {
             "Content-Type": "application/json",
@@ -725,14 +740,15 @@ class WorkflowTester(WorkflowTesterBase):
         }
 
         try:
-            response = requests.post(
+            # 默认复用 self.session 的连接池；并发候选由调用方为每个线程传入独立 Session
+            response = (session or self.session).post(
                 self.llm_api_url,
                 headers=headers,
                 json=payload,
                 timeout=30
             )
             response.raise_for_status()
-            result = response.json()
+            result = self._parse_json(response)
             return result["choices"][0]["message"]["content"].strip()
         except requests.exceptions.RequestException as e:
             print(f"❌ HTTP POST 调用失败: {str(e)}")
@@ -741,65 +757,23 @@ class WorkflowTester(WorkflowTesterBase):
             print(f"❌ 解析响应失败: {str(e)}")
             return None
 
-    def _retry_request(self, request_func, *args, **kwargs):
-        """
-        通用重试机制
-
-        Args:
-            request_func: 要执行的请求函数
-            *args, **kwargs: 传递给请求函数的参数
-
-        Returns:
-            请求结果
-        """
-        last_exception = None
-
-        for attempt in range(self.max_retries):
-            try:
-                # 动态调整超时时间
-                timeout = self.base_timeout * (attempt + 1)
-                if 'timeout' in kwargs:
-                    kwargs['timeout'] = timeout
-
-                print(f"🔄 尝试第 {attempt + 1}/{self.max_retries} 次请求 (超时: {timeout}秒)...")
-
-                result = request_func(*args, **kwargs)
-
-                # 如果成功，返回结果
-                if attempt > 0:
-                    print(f"✅ 重试成功！")
-                return result
-
-            except requests.exceptions.ReadTimeout as e:
-                last_exception = e
-                print(f"⚠️  请求超时 (尝试 {attempt + 1}/{self.max_retries})")
-
-                if attempt < self.max_retries - 1:
-                    # 计算退避等待时间
-                    wait_time = self.retry_backoff ** attempt
-                    print(f"⏳ 等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                else:
-                    print(f"❌ 已达到最大重试次数")
-
-            except requests.exceptions.RequestException as e:
-                # 其他网络错误，不重试
-                print(f"❌ 网络请求失败: {str(e)}")
-                raise Exception(f"网络请求失败: {str(e)}")
-
-        # 所有重试都失败
-        raise Exception(f"请求超时，已重试 {self.max_retries} 次")
-
-    def _post_json(self, url: str, payload: Dict, timeout: int):
-        """Override base POST to add retries."""
-        def make_request():
-            return self.session.post(
-                url,
-                json=payload,
-                headers=self.headers,
-                timeout=timeout,
-            )
-        return self._retry_request(make_request)
+    def _stream_doubao_sdk(self, messages, temperature=0.7, top_p=0.9):
+        """以流式方式调用 Doubao SDK 并拼接完整回答（首个 token 即开始接收，长回答不易读超时）"""
+        stream = self.doubao_client.chat.completions.create(
+            model=self.doubao_model,
+            messages=messages,
+            temperature=temperature,
+            top_p=top_p,
+            stream=True,
+        )
+        chunks = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                chunks.append(delta)
+        return "".join(chunks)
 
     def _log_run_card(self, step_id, payload, response_data):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -807,8 +781,8 @@ class WorkflowTester(WorkflowTesterBase):
         # 同时记录 step_name 和 step_id，便于阅读和回放
         log_lines = [
             f"[{timestamp}] Step: {step_name} | step_id: {step_id}",
-            f"请求载荷: {json.dumps(payload, ensure_ascii=False)}",
-            f"响应内容: {json.dumps(response_data, ensure_ascii=False)}",
+            f"请求载荷: {self._format_json(payload)}",
+            f"响应内容: {self._format_json(response_data)}",
             "-" * 80,
         ]
         self._append_log(self.run_card_log_path, "\n".join(log_lines))
@@ -916,96 +890,172 @@ class WorkflowTester(WorkflowTesterBase):
             return None
 
         try:
-            profile_info = self._get_student_profile_info()
-            system_prompt = (
-                "你是一名能力训练助手，需要严格按照给定的学生档位扮演角色。"
-            )
+            if self.doubao_candidates > 1:
+                candidates = self.generate_answer_candidates(question, n=self.doubao_candidates)
+                return self._vote_candidates(candidates)
 
-            sections = [
-                "## 角色设定",
-                f"学生档位: {profile_info['label']}",
-                f"角色特征: {profile_info['description']}",
-                f"表达风格: {profile_info['style']}",
-                "",
-            ]
+            return self._complete_doubao(self._build_doubao_messages(question))
+        except Exception as e:
+            print(f"❌ 调用 {self.model_type} 模型失败: {str(e)}")
+            return None
+
+    def _get_system_prompt(self) -> str:
+        """
+        构造静态系统提示词（角色设定 + 问题类型规则 + 示例对话 + 知识库 + 输出要求）
 
-            # 添加问题类型识别（优先级最高）
+        这些内容在整个工作流中不变，放在 system 消息开头可让服务端复用前缀缓存，
+        每轮只需预填对话历史和当前问题；档位或知识库变化时才重建。
+        """
+        cache_key = (
+            self.student_profile_key,
+            self.dialogue_samples_content,
+            self.knowledge_base_content,
+        )
+        if getattr(self, "_cached_system_key", None) == cache_key:
+            return self._cached_system
+
+        profile_info = self._get_student_profile_info()
+        sections = [
+            "你是一名能力训练助手，需要严格按照给定的学生档位扮演角色。",
+            "",
+            "## 角色设定",
+            f"学生档位: {profile_info['label']}",
+            f"角色特征: {profile_info['description']}",
+            f"表达风格: {profile_info['style']}",
+            "",
+        ]
+
+        # 添加问题类型识别（优先级最高）
+        sections.extend([
+            "## 问题类型识别（优先级最高）",
+            "如果当前问题属于以下类型，请优先直接回答，不需要强制体现性格特点：",
+            "1. **确认式问题**: 如'你准备好了吗？请回复是或否'、'确认的话请回复是'",
+            "   → 直接回答'是'、'好的'、'确认'等",
+            "2. **选择式问题**: 如'你选择A还是B？'、'请选择1/2/3'",
+            "   → 直接说出选项，如'我选择A'、'选1'",
+            "3. **角色确认问题**: 如'你是学生还是老师？'",
+            "   → 直接回答角色，如'学生'",
+            "",
+            "**判断标准**: 如果问题中包含'请回复'、'请选择'、'是或否'、'A/B/C'等明确指示，则为封闭式问题。",
+            "",
+        ])
+
+        if self.dialogue_samples_content:
             sections.extend([
-                "## 问题类型识别（优先级最高）",
-                "如果当前问题属于以下类型，请优先直接回答，不需要强制体现性格特点：",
-                "1. **确认式问题**: 如'你准备好了吗？请回复是或否'、'确认的话请回复是'",
-                "   → 直接回答'是'、'好的'、'确认'等",
-                "2. **选择式问题**: 如'你选择A还是B？'、'请选择1/2/3'",
-                "   → 直接说出选项，如'我选择A'、'选1'",
-                "3. **角色确认问题**: 如'你是学生还是老师？'",
-                "   → 直接回答角色，如'学生'",
-                "",
-                "**判断标准**: 如果问题中包含'请回复'、'请选择'、'是或否'、'A/B/C'等明确指示，则为封闭式问题。",
+                "## 档位示例对话 (如有匹配请优先引用或改写，优先级最高)",
+                self.dialogue_samples_content,
                 "",
             ])
 
-            if self.dialogue_samples_content:
-                sections.extend([
-                    "## 档位示例对话 (如有匹配请优先引用或改写，优先级最高)",
-                    self.dialogue_samples_content,
-                    "",
-                ])
-
-            if self.knowledge_base_content:
-                sections.extend([
-                    "## 参考知识库 (可结合使用)",
-                    self.knowledge_base_content,
-                    "",
-                ])
-
-            # 添加对话历史
-            if self.conversation_history:
-                sections.extend([
-                    "## 对话历史（按时间顺序）",
-                ])
-                for i, turn in enumerate(self.conversation_history, 1):
-                    sections.append(f"第{i}轮:")
-                    sections.append(f"  AI提问: {turn['ai']}")
-                    sections.append(f"  学生回答: {turn['student']}")
-                sections.append("")
-
+        if self.knowledge_base_content:
             sections.extend([
-                "## 当前问题",
-                question,
+                "## 参考知识库 (可结合使用)",
+                self.knowledge_base_content,
                 "",
-                "## 输出要求（按优先级执行）",
-                "**优先级1**: 如果是封闭式问题（确认式/选择式/角色确认），直接简短回答",
-                "**优先级2**: 如果示例对话中有高度相关的回答，请优先引用或改写",
-                "**优先级3**: 如果是开放式问题，再适度融入学生档位特点",
-                "**格式要求**: 仅返回学生回答内容，不要额外解释，控制在50字以内。",
-                ""
             ])
 
-            user_message = "\n".join(sections)
+        sections.extend([
+            "## 输出要求（按优先级执行）",
+            "**优先级1**: 如果是封闭式问题（确认式/选择式/角色确认），直接简短回答",
+            "**优先级2**: 如果示例对话中有高度相关的回答，请优先引用或改写",
+            "**优先级3**: 如果是开放式问题，再适度融入学生档位特点",
+            "**格式要求**: 仅返回学生回答内容，不要额外解释，控制在50字以内。",
+        ])
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
+        self._cached_system = "\n".join(sections)
+        self._cached_system_key = cache_key
+        return self._cached_system
 
-            # 根据配置选择调用方式
-            if self.model_type == "doubao_post":
+    def _build_doubao_messages(self, question):
+        """构造 Doubao 调用所需的 messages（system 为缓存的静态前缀，user 只含对话历史和当前问题）"""
+        sections = []
+
+        # 添加对话历史
+        if self.conversation_history:
+            sections.extend([
+                "## 对话历史（按时间顺序）",
+            ])
+            for i, turn in enumerate(self.conversation_history, 1):
+                sections.append(f"第{i}轮:")
+                sections.append(f"  AI提问: {turn['ai']}")
+                sections.append(f"  学生回答: {turn['student']}")
+            sections.append("")
+
+        sections.extend([
+            "## 当前问题",
+            question,
+        ])
+
+        return [
+            {"role": "system", "content": self._get_system_prompt()},
+            {"role": "user", "content": "\n".join(sections)}
+        ]
+
+    def _complete_doubao(self, messages, verbose=True, session=None):
+        """根据配置选择调用方式，返回模型回答"""
+        if self.model_type == "doubao_post":
+            if verbose:
                 print("🔄 使用 Doubao POST API 调用...")
-                answer = self._call_doubao_post(messages, temperature=0.7, max_tokens=1000)
-            else:  # doubao_sdk
-                print("🔄 使用 Doubao OpenAI SDK 调用...")
-                response = self.doubao_client.chat.completions.create(
-                    model=self.doubao_model,
-                    messages=messages,
-                    temperature=0.7,
-                    top_p=0.9
-                )
-                answer = response.choices[0].message.content
-
-            return answer
-        except Exception as e:
-            print(f"❌ 调用 {self.model_type} 模型失败: {str(e)}")
+            return self._call_doubao_post(messages, temperature=0.7, max_tokens=1000, session=session)
+        # doubao_sdk
+        if verbose:
+            print("🔄 使用 Doubao OpenAI SDK 调用...")
+        return self._stream_doubao_sdk(messages, temperature=0.7, top_p=0.9)
+
+    def _complete_doubao_with_retry(self, messages, attempts=3, session=None):
+        """单个候选的调用：失败或返回空时按指数退避重试"""
+        for attempt in range(attempts):
+            try:
+                answer = self._complete_doubao(messages, verbose=False, session=session)
+                if answer:
+                    return answer
+            except Exception as e:
+                print(f"⚠️  候选生成失败 (尝试 {attempt + 1}/{attempts}): {str(e)}")
+            if attempt < attempts - 1:
+                time.sleep(self.retry_backoff ** attempt)
+        return None
+
+    def generate_answer_candidates(self, question, n=5):
+        """
+        并发生成 n 个候选回答（并发数受 doubao_max_concurrency 限制）
+
+        Args:
+            question: AI提问
+            n: 候选数量
+
+        Returns:
+            成功生成的候选回答列表
+        """
+        messages = self._build_doubao_messages(question)
+        print(f"🔄 并发生成 {n} 个候选回答...")
+
+        def generate_one(_):
+            if self.model_type != "doubao_post":
+                # SDK 底层的 httpx.Client 是线程安全的，可直接共享
+                return self._complete_doubao_with_retry(messages)
+            # requests.Session 不是线程安全的，每个候选使用独立 Session
+            with requests.Session() as session:
+                return self._complete_doubao_with_retry(messages, session=session)
+
+        with ThreadPoolExecutor(max_workers=min(n, self.doubao_max_concurrency)) as pool:
+            results = list(pool.map(generate_one, range(n)))
+        return [answer.strip() for answer in results if answer]
+
+    @staticmethod
+    def _vote_candidates(candidates: List[str]) -> Optional[str]:
+        """多数投票：完全相同的回答按票数取胜，否则取与其他候选平均相似度最高的一个"""
+        if not candidates:
             return None
+        counts: Dict[str, int] = {}
+        for answer in candidates:
+            counts[answer] = counts.get(answer, 0) + 1
+        best, votes = max(counts.items(), key=lambda item: item[1])
+        if votes > 1 or len(candidates) == 1:
+            return best
+        return max(
+            candidates,
+            key=lambda a: sum(DialogueMatcher.calculate_similarity(a, b) for b in candidates if b is not a),
+        )
 
     def run_semi_interactive(self, task_id, breakpoint_round: int = 0):
         """
@@ -1135,7 +1185,6 @@ class WorkflowTester(WorkflowTesterBase):
                     break
 
                 round_num += 1
-                time.sleep(0.5)
 
             print("\n" + "=" * 60)
             print("🎉 工作流测试结束")
@@ -1218,7 +1267,6 @@ class WorkflowTester(WorkflowTesterBase):
                     break
 
                 round_num += 1
-                time.sleep(1)  # 稍微延迟，避免请求过快
 
             print("\n" + "="*60)
             print("🎉 工作流测试结束")
@@ -1,7 +1,6 @@
 import asyncio
 import requests
 import json
-import time
 import os
 from datetime import datetime
 from pathlib import Path
@@ -205,14 +204,15 @@ class WorkflowTester(WorkflowTesterBase):
         }
 
         try:
-            response = requests.post(
+            # 复用 self.session 的连接池，多轮调用无需重复握手
+            response = self.session.post(
                 self.llm_api_url,
                 headers=headers,
                 json=payload,
                 timeout=30
             )
             response.raise_for_status()
-            result = response.json()
+            result = self._parse_json(response)
             return result["choices"][0]["message"]["content"].strip()
         except requests.exceptions.RequestException as e:
             print(f"❌ HTTP POST 调用失败: {str(e)}")
@@ -272,6 +272,79 @@ class WorkflowTester(WorkflowTesterBase):
         await asyncio.gather(*tasks)
         print("\n✅ 所有选定的学生角色已运行完成。")
 
+    def _get_prompt_scaffold(self):
+        """
+        返回用户提示词中固定的前缀和后缀（角色设定、示例对话、知识库、输出要求）
+
+        只在学生角色、示例对话或知识库变化时重建，避免每轮都重新拼接整份知识库
+        """
+        key = (self.student_profile_key, self.dialogue_samples_content, self.knowledge_base_content)
+        if getattr(self, "_prompt_scaffold_key", None) == key:
+            return self._prompt_scaffold
+
+        profile_info = self._get_student_profile_info()
+        sections = [
+            "## 角色设定",
+            f"学生角色: {profile_info['label']}",
+            f"角色特征: {profile_info['description']}",
+        ]
+
+        if profile_info.get("speech_habit"):
+            sections.append(f"说话习惯: {profile_info['speech_habit']}")
+
+        sections.append(f"表达风格: {profile_info['style']}")
+
+        if profile_info.get("test_goal"):
+            sections.append(f"测试目的: {profile_info['test_goal']}")
+
+        sections.append("")
+
+        # 添加问题类型识别
+        sections.extend([
+            "## 问题类型识别（优先级最高）",
+            "如果当前问题属于以下类型，请优先直接回答，不需要强制体现性格特点：",
+            "1. **确认式问题**: 如'你准备好了吗？请回复是或否'、'确认的话请回复是'",
+            "   → 直接回答'是'、'好的'、'确认'等",
+            "2. **选择式问题**: 如'你选择A还是B？'、'请选择1/2/3'",
+            "   → 直接说出选项，如'我选择A'、'选1'",
+            "3. **角色确认问题**: 如'你是学生还是老师？'",
+            "   → 直接回答角色，如'学生'",
+            "",
+            "**判断标准**: 如果问题中包含'请回复'、'请选择'、'是或否'、'A/B/C'等明确指示，则为封闭式问题。",
+            ""
+        ])
+
+        if self.dialogue_samples_content:
+            sections.extend([
+                "## 角色示例对话 (如有匹配请优先引用或改写，优先级最高)",
+                self.dialogue_samples_content,
+                "",
+            ])
+
+        if self.knowledge_base_content:
+            sections.extend([
+                "## 参考知识库 (可结合使用)",
+                self.knowledge_base_content,
+                "",
+            ])
+
+        suffix = "\n" + "\n".join([
+            "",
+            "## 输出要求（按优先级执行）",
+            "**优先级1**: 优先输出角色示例对话中的内容",
+            "**优先级2**: 如果是开放式问题，再适度融入学生性格特点，但要注意：",
+            "   - 性格特点应该自然体现，不要生硬套用",
+            "   - 避免每次都使用相同的话术（如不要总说'这说不通'、'不知道'等）",
+            "   - 保持回答的多样性和真实性，可以偶尔正常回答",
+            "**优先级3**: 如果示例对话中有高度相关的回答，可以参考但需变化表达方式。",
+            "**格式要求**: 仅返回学生回答内容，不要额外解释，控制在50字以内。",
+            ""
+        ])
+
+        self._prompt_scaffold_key = key
+        self._prompt_scaffold = ("\n".join(sections) + "\n", suffix)
+        return self._prompt_scaffold
+
     def generate_answer_with_llm(self, question):
         """使用 LLM 模型生成回答"""
         # 检查是否有可用的调用方式
@@ -286,57 +359,15 @@ class WorkflowTester(WorkflowTesterBase):
             return None
 
         try:
-            profile_info = self._get_student_profile_info()
             system_prompt = (
                 "你是一名能力训练助手，需要模拟学生角色进行回答。"
                 "注意：性格特点应该自然融入对话，而非生硬套用，要保持回答的真实性和多样性。"
                 "如果有角色示例对话，请优先引用或改写。"
             )
 
-            sections = [
-                "## 角色设定",
-                f"学生角色: {profile_info['label']}",
-                f"角色特征: {profile_info['description']}",
-            ]
-
-            if profile_info.get("speech_habit"):
-                sections.append(f"说话习惯: {profile_info['speech_habit']}")
-
-            sections.append(f"表达风格: {profile_info['style']}")
-
-            if profile_info.get("test_goal"):
-                sections.append(f"测试目的: {profile_info['test_goal']}")
-
-            sections.append("")
-
-            # 添加问题类型识别
-            sections.extend([
-                "## 问题类型识别（优先级最高）",
-                "如果当前问题属于以下类型，请优先直接回答，不需要强制体现性格特点：",
-                "1. **确认式问题**: 如'你准备好了吗？请回复是或否'、'确认的话请回复是'",
-                "   → 直接回答'是'、'好的'、'确认'等",
-                "2. **选择式问题**: 如'你选择A还是B？'、'请选择1/2/3'",
-                "   → 直接说出选项，如'我选择A'、'选1'",
-                "3. **角色确认问题**: 如'你是学生还是老师？'",
-                "   → 直接回答角色，如'学生'",
-                "",
-                "**判断标准**: 如果问题中包含'请回复'、'请选择'、'是或否'、'A/B/C'等明确指示，则为封闭式问题。",
-                ""
-            ])
-
-            if self.dialogue_samples_content:
-                sections.extend([
-                    "## 角色示例对话 (如有匹配请优先引用或改写，优先级最高)",
-                    self.dialogue_samples_content,
-                    "",
-                ])
-
-            if self.knowledge_base_content:
-                sections.extend([
-                    "## 参考知识库 (可结合使用)",
-                    self.knowledge_base_content,
-                    "",
-                ])
+            # 固定部分（角色设定/示例对话/知识库/输出要求）取缓存，只拼接对话历史和当前问题
+            prefix, suffix = self._get_prompt_scaffold()
+            sections = []
 
             # 添加对话历史
             if self.conversation_history:
@@ -352,19 +383,9 @@ class WorkflowTester(WorkflowTesterBase):
             sections.extend([
                 "## 当前问题",
                 question,
-                "",
-                "## 输出要求（按优先级执行）",
-                "**优先级1**: 优先输出角色示例对话中的内容",
-                "**优先级2**: 如果是开放式问题，再适度融入学生性格特点，但要注意：",
-                "   - 性格特点应该自然体现，不要生硬套用",
-                "   - 避免每次都使用相同的话术（如不要总说'这说不通'、'不知道'等）",
-                "   - 保持回答的多样性和真实性，可以偶尔正常回答",
-                "**优先级3**: 如果示例对话中有高度相关的回答，可以参考但需变化表达方式。",
-                "**格式要求**: 仅返回学生回答内容，不要额外解释，控制在50字以内。",
-                ""
             ])
 
-            user_message = "\n".join(sections)
+            user_message = prefix + "\n".join(sections) + suffix
 
             messages = [
                 {"role": "system", "content": system_prompt},
@@ -476,7 +497,6 @@ class WorkflowTester(WorkflowTesterBase):
                     break
 
                 round_num += 1
-                time.sleep(1)  # 稍微延迟，避免请求过快
 
             self._finalize_workflow()
 
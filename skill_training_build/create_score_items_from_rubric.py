@@ -73,6 +73,16 @@ def get_headers():
 # Markdown 解析
 # ---------------------------------------------------------------------------
 
+# 主评分项标题，形如：## 名称（N分） 或 ## 名称(N分)
+SECTION_PATTERN = re.compile(
+    r"^##\s+(.+?)\s*[（(](\d+)\s*分[）)]",
+    re.MULTILINE,
+)
+# "### 得分点：" 分隔标题
+SCORE_POINT_PATTERN = re.compile(r"###\s*得分点[：:]?")
+# 段末的 --- 分隔线
+TRAILING_RULE_PATTERN = re.compile(r"\n---\s*$")
+
 
 def parse_rubric_markdown(md_path: Path) -> list[dict]:
     """
@@ -87,14 +97,8 @@ def parse_rubric_markdown(md_path: Path) -> list[dict]:
     content = md_path.read_text(encoding="utf-8")
 
     # 用 ## 切割，每段对应一个主评分项（跳过 # 总标题 和总结说明段）
-    # 匹配形如：## 名称（N分） 或 ## 名称(N分)
-    section_pattern = re.compile(
-        r"^##\s+(.+?)\s*[（(](\d+)\s*分[）)]",
-        re.MULTILINE,
-    )
-
     # 找到所有主项标题的位置
-    matches = list(section_pattern.finditer(content))
+    matches = list(SECTION_PATTERN.finditer(content))
     if not matches:
         return []
 
@@ -110,7 +114,7 @@ def parse_rubric_markdown(md_path: Path) -> list[dict]:
         body = content[body_start:body_end]
 
         # ---- 提取 description：标题后到 "### 得分点" 之前的段落 ----
-        score_point_split = re.split(r"###\s*得分点[：:]?", body, maxsplit=1)
+        score_point_split = SCORE_POINT_PATTERN.split(body, maxsplit=1)
         pre_section = score_point_split[0]
 
         # 去掉分隔线、空行，取第一段非空文本作为 description
@@ -128,7 +132,7 @@ def parse_rubric_markdown(md_path: Path) -> list[dict]:
             require_raw = ""
 
         # 去掉末尾的 --- 分隔线和空行
-        require_detail = re.sub(r"\n---\s*$", "", require_raw.strip()).strip()
+        require_detail = TRAILING_RULE_PATTERN.sub("", require_raw.strip()).strip()
 
         score_items.append(
             {
@@ -186,9 +190,7 @@ def create_score_item(train_task_id: str, item: dict) -> str | None:
 def main():
     load_env_config()
 
-    print("\n" + "=" * 55)
-    print("📊  评价标准自动创建工具")
-    print("=" * 55)
+    print(f"\n{'=' * 55}\n📊  评价标准自动创建工具\n{'=' * 55}")
 
     # --- 训练任务 ID ---
     train_task_id = os.getenv("TASK_ID", "")
@@ -224,13 +226,15 @@ def main():
         print("❌ 未解析到任何评分项，请检查 Markdown 格式。")
         return
 
-    print(f"✅ 共解析到 {len(items)} 个评分项：")
-    total_score = 0
-    for idx, item in enumerate(items, 1):
-        print(f"   {idx}. {item['itemName']}  ({item['score']} 分)")
-        total_score += item["score"]
-    print(f"   {'─' * 35}")
-    print(f"   合计：{total_score} 分")
+    total_score = sum(item["score"] for item in items)
+    summary = [f"✅ 共解析到 {len(items)} 个评分项："]
+    summary.extend(
+        f"   {idx}. {item['itemName']}  ({item['score']} 分)"
+        for idx, item in enumerate(items, 1)
+    )
+    summary.append(f"   {'─' * 35}")
+    summary.append(f"   合计：{total_score} 分")
+    print("\n".join(summary))
 
     # --- 确认 ---
     confirm = input(f"\n❓ 确认创建以上 {len(items)} 个评分项？[y/N]: ").strip().lower()
@@ -239,9 +243,7 @@ def main():
         return
 
     # --- 创建 ---
-    print("\n" + "═" * 55)
-    print("🚀  开始创建评分项")
-    print("═" * 55)
+    print(f"\n{'═' * 55}\n🚀  开始创建评分项\n{'═' * 55}")
 
     success_count = 0
     for idx, item in enumerate(items, 1):
@@ -253,11 +255,11 @@ def main():
         else:
             print(f"  ❌ 创建失败")
 
-    print("\n" + "=" * 55)
-    print("🎉  完成！")
-    print("=" * 55)
-    print(f"  成功: {success_count} / {len(items)}")
-    print(f"  任务 ID: {train_task_id}\n")
+    print(
+        f"\n{'=' * 55}\n🎉  完成！\n{'=' * 55}\n"
+        f"  成功: {success_count} / {len(items)}\n"
+        f"  任务 ID: {train_task_id}\n"
+    )
 
 
 if __name__ == "__main__":
@@ -1,13 +1,23 @@
+import atexit
 import json
+import mmap
 import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, TextIO
 
 import requests
 from dotenv import load_dotenv
 
+try:
+    import orjson  # Optional: faster JSON encoding for log payloads
+except ImportError:
+    orjson = None
+
 
 class WorkflowTesterBase:
     """Common workflow tester logic shared by auto_script_train*.py scripts.
@@ -15,18 +25,25 @@ class WorkflowTesterBase:
     Subclasses should:
     - Set DEFAULT_PROFILE_KEY / PROFILE_LABEL_FIELD_NAME / PROFILE_SELECT_TITLE if needed.
     - Populate self.student_profiles in __init__ (e.g., from class constant or config file).
-    - Override _post_json to add retries if desired.
+    - Tune max_retries / retry_backoff if the default retry policy of _post_json does not fit.
     - Override _log_run_card / _log_dialogue_entry if log format must differ.
     """
 
     DEFAULT_PROFILE_KEY: str = ""
     PROFILE_LABEL_FIELD_NAME: str = "学生档位"
     PROFILE_SELECT_TITLE: str = "学生档位"
+    # Gateway errors worth retrying; anything else is returned to the caller as-is.
+    RETRY_STATUS_CODES = frozenset({502, 503, 504})
 
     def __init__(self, base_url: str = "https://cloudapi.polymas.com"):
         self.base_url = base_url
         self.session = requests.Session()
 
+        # Retry policy for workflow POSTs (see _retry_request)
+        self.max_retries: int = 3
+        self.retry_backoff: float = 2
+        self.retry_max_wait: float = 8
+
         # Workflow state
         self.session_id: Optional[str] = None
         self.current_step_id: Optional[str] = None
@@ -40,6 +57,8 @@ class WorkflowTesterBase:
         self.dialogue_log_path: Optional[Path] = None
         self.log_prefix: Optional[str] = None
         self.log_context_path: Optional[Path] = None
+        # Open TXT log handles, kept for the whole workflow (closed by _close_logs or at exit)
+        self._log_handles: Dict[Path, TextIO] = {}
 
         # Log format / JSON logging (subclasses may enable)
         self.log_format: str = "txt"  # "txt" | "json" | "both"
@@ -52,9 +71,19 @@ class WorkflowTesterBase:
         self.student_profile_key: Optional[str] = None
         self.student_profiles: Dict[str, Dict[str, Any]] = {}
         self.dialogue_samples_content: Optional[str] = None
+        # Text KBs are mapped, not read: decoded on first access of knowledge_base_content
+        self._kb_mmap: Optional[mmap.mmap] = None
+        # Parallel profile runs (5characters) may hit the first decode from several threads
+        self._kb_lock = threading.Lock()
         self.knowledge_base_content: Optional[str] = None
         self.conversation_history: List[Dict[str, str]] = []
 
+        # Chat pacing: at most one chat request per CHAT_MIN_INTERVAL seconds.
+        # Time already spent between turns (LLM generation, user typing) counts
+        # toward the interval, so a slow turn is not padded with an extra sleep.
+        self.chat_min_interval: float = float(os.getenv("CHAT_MIN_INTERVAL", "1"))
+        self._last_chat_ts: float = 0.0
+
         # Step name mapping for nicer logs (optional)
         self.step_name_mapping: Dict[str, str] = {}
 
@@ -83,10 +112,127 @@ class WorkflowTesterBase:
             except json.JSONDecodeError:
                 print("⚠️  警告: CUSTOM_HEADERS 格式不正确，已忽略")
 
+    @property
+    def knowledge_base_content(self) -> Optional[str]:
+        if self._kb_mmap is None:
+            return self._knowledge_base_content
+        with self._kb_lock:
+            # Re-check: another thread may have finished the decode while we waited
+            kb_mmap = self._kb_mmap
+            if kb_mmap is not None:
+                try:
+                    # Same universal-newline translation read_text() applies
+                    text = str(kb_mmap[:], "utf-8")
+                    if "\r" in text:
+                        text = text.replace("\r\n", "\n").replace("\r", "\n")
+                except UnicodeDecodeError as e:
+                    # Not validated at load (that would decode the file twice): report on first use
+                    print(f"❌ 知识库不是有效的 UTF-8 文本，本次运行不使用知识库: {e}")
+                    text = None
+                finally:
+                    kb_mmap.close()
+                # Publish the text before clearing the mapping so lock-free readers never see a stale None
+                self._knowledge_base_content = text
+                self._kb_mmap = None
+        return self._knowledge_base_content
+
+    @knowledge_base_content.setter
+    def knowledge_base_content(self, value: Optional[str]):
+        with self._kb_lock:
+            if self._kb_mmap is not None:
+                self._kb_mmap.close()
+                self._kb_mmap = None
+            self._knowledge_base_content = value
+
+    def _map_knowledge_base(self, path: Path) -> int:
+        """Map a text KB for lazy decoding; returns its size in bytes."""
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                # mmap cannot map empty files
+                self.knowledge_base_content = ""
+                return 0
+            kb_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with self._kb_lock:
+            if self._kb_mmap is not None:
+                self._kb_mmap.close()
+            self._knowledge_base_content = None
+            self._kb_mmap = kb_mmap
+        return size
+
     # ---- Request helper ----
-    def _post_json(self, url: str, payload: Dict[str, Any], timeout: int):
-        """POST helper. Subclasses can override to add retries."""
-        return self.session.post(url, json=payload, headers=self.headers, timeout=timeout)
+    def _post_json(self, url: str, payload: Dict[str, Any], timeout: int, idempotent: bool = True):
+        """POST helper with retries on transient network / gateway errors.
+
+        Pass idempotent=False for requests the server must not see twice (runCard, chat):
+        those are only retried when the connection could not be established.
+        """
+        # self.headers already carries Content-Type: application/json
+        body = orjson.dumps(payload) if orjson is not None else None
+
+        def make_request(timeout):
+            if body is not None:
+                return self.session.post(url, data=body, headers=self.headers, timeout=timeout)
+            return self.session.post(url, json=payload, headers=self.headers, timeout=timeout)
+        return self._retry_request(make_request, timeout=timeout, _idempotent=idempotent)
+
+    def _retry_request(self, request_func, *args, _idempotent: bool = True, **kwargs):
+        """
+        通用重试机制：超时、连接错误和网关错误（502/503/504）按指数退避 + 随机抖动重试，
+        每次重试放宽超时时间；其他请求异常直接抛给调用方。
+
+        非幂等请求（_idempotent=False，如 runCard、chat）只在连接超时（请求未发出）时重试：
+        读超时或网关错误时服务端可能已经处理过这次请求，重发会重复提交回答。
+
+        Args:
+            request_func: 要执行的请求函数（返回 requests.Response）
+            *args, **kwargs: 传递给请求函数的参数（如包含 timeout，则按尝试次数放大）
+
+        Returns:
+            请求结果；重试用尽时抛出最后一次的原始异常，或返回最后一次的网关错误响应
+        """
+        if _idempotent:
+            retry_errors = (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+        else:
+            retry_errors = (requests.exceptions.ConnectTimeout,)
+        base_timeout = kwargs.get("timeout")
+
+        for attempt in range(self.max_retries):
+            last_attempt = attempt == self.max_retries - 1
+            if base_timeout is not None:
+                kwargs["timeout"] = base_timeout * (attempt + 1)
+            try:
+                response = request_func(*args, **kwargs)
+            except retry_errors as e:
+                if last_attempt:
+                    raise
+                last_error = f"{type(e).__name__}: {e}"
+            else:
+                if (
+                    not _idempotent
+                    or response.status_code not in self.RETRY_STATUS_CODES
+                    or last_attempt
+                ):
+                    if attempt > 0 and response.status_code not in self.RETRY_STATUS_CODES:
+                        print("✅ 重试成功！")
+                    return response
+                last_error = f"HTTP {response.status_code}"
+
+            print(f"⚠️  请求失败 (尝试 {attempt + 1}/{self.max_retries}): {last_error}")
+            # 抖动避免多个并发流程（如 5characters 并行角色）同时重试
+            wait_time = min(self.retry_max_wait, self.retry_backoff ** attempt)
+            wait_time = random.uniform(wait_time / 2, wait_time)
+            print(f"⏳ 等待 {wait_time:.1f} 秒后重试...")
+            time.sleep(wait_time)
+
+    def _pace_chat(self):
+        """Block only for whatever is left of chat_min_interval since the last chat."""
+        now = time.monotonic()
+        wait = self._last_chat_ts + self.chat_min_interval - now
+        if wait > 0:
+            time.sleep(wait)
+            now += wait
+        self._last_chat_ts = now
 
     # ---- Logging ----
     def _prepare_log_files(self, task_id: str):
@@ -124,19 +270,63 @@ class WorkflowTesterBase:
             header_lines.append("=" * 60)
             header = "\n".join(header_lines) + "\n"
 
+            # A previous workflow on this instance may still hold handles
+            self._close_logs()
+            atexit.register(self._close_logs)
             for path, title in [
                 (self.run_card_log_path, "RunCard 信息记录"),
                 (self.dialogue_log_path, "对话记录"),
             ]:
-                with open(path, "w", encoding="utf-8") as f:
-                    f.write(title + "\n")
-                    f.write(header)
+                f = open(path, "w", encoding="utf-8", buffering=1 << 16)
+                f.write(title + "\n")
+                f.write(header)
+                self._log_handles[path] = f
 
     def _append_log(self, path: Optional[Path], text: str):
         if not path:
             return
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(text + "\n")
+        f = self._log_handles.get(path)
+        if f is None or f.closed:
+            if not self._log_handles:
+                atexit.register(self._close_logs)
+            f = self._log_handles[path] = open(path, "a", encoding="utf-8", buffering=1 << 16)
+        f.write(text + "\n")
+
+    def _close_logs(self):
+        """Flush and close all open TXT log handles."""
+        # Only registered while handles are open, so finished testers (and the
+        # parallel clones in 5characters) are not kept alive until exit
+        atexit.unregister(self._close_logs)
+        handles, self._log_handles = self._log_handles, {}
+        for f in handles.values():
+            try:
+                f.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _format_json(obj: Any) -> str:
+        """Serialize a payload for the TXT logs (orjson when available)."""
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+            except TypeError:
+                pass
+        return json.dumps(obj, ensure_ascii=False)
+
+    @staticmethod
+    def _parse_json(response: requests.Response) -> Any:
+        """Parse a JSON response body (orjson when available).
+
+        Invalid bodies fall through to response.json() so callers still see
+        requests' JSONDecodeError (a RequestException) as before.
+        """
+        if orjson is not None:
+            try:
+                return orjson.loads(response.content)
+            except orjson.JSONDecodeError:
+                pass
+        return response.json()
 
     def _get_step_display_name(self, step_id: Optional[str]) -> str:
         """Return readable name for step_id if mapping available."""
@@ -152,8 +342,8 @@ class WorkflowTesterBase:
         # 同时记录 step_name 和 step_id，便于阅读和回放
         log_lines = [
             f"Step: {step_name} | step_id: {step_id}",
-            f"请求载荷: {json.dumps(payload, ensure_ascii=False)}",
-            f"响应内容: {json.dumps(response_data, ensure_ascii=False)}",
+            f"请求载荷: {self._format_json(payload)}",
+            f"响应内容: {self._format_json(response_data)}",
             "-" * 40,
         ]
         self._append_log(self.run_card_log_path, "\n".join(log_lines))
@@ -433,10 +623,11 @@ class WorkflowTesterBase:
 
             # 检测文件类型并处理
             suffix = path.suffix.lower()
+            kb_size = None  # 文本知识库的字节数（延迟解码，首次使用时才读入）
 
             if suffix == ".md":
-                # 直接读取 Markdown 文件
-                self.knowledge_base_content = path.read_text(encoding="utf-8")
+                # Markdown 文件只做内存映射，首次生成回答时才解码
+                kb_size = self._map_knowledge_base(path)
             elif suffix == ".docx":
                 # 自动转换 docx 为 Markdown
                 try:
@@ -461,12 +652,15 @@ class WorkflowTesterBase:
                 print(f"❌ 暂不支持 .doc 格式，请先转换为 .docx 或 .md 格式")
                 return False
             else:
-                # 尝试作为文本文件读取
-                self.knowledge_base_content = path.read_text(encoding="utf-8")
+                # 尝试作为文本文件读取（同样延迟解码）
+                kb_size = self._map_knowledge_base(path)
 
-            print(
-                f"✅ 知识库已加载: {kb_path} (大小: {len(self.knowledge_base_content)} 字符)"
-            )
+            if kb_size is not None:
+                print(f"✅ 知识库已加载: {kb_path} (大小: {kb_size} 字节)")
+            else:
+                print(
+                    f"✅ 知识库已加载: {kb_path} (大小: {len(self.knowledge_base_content)} 字符)"
+                )
             self._update_log_context(path)
             return True
         except Exception as e:
@@ -493,22 +687,30 @@ class WorkflowTesterBase:
 
         print("\n2️⃣  测试网络连接:")
         try:
-            response = requests.get(self.base_url, timeout=10)
+            # 走共享 session：连通性检查同时完成 TLS 握手，后续接口调用直接复用连接
+            response = self.session.get(self.base_url, timeout=10)
             print(f"✅ 服务器可访问 (状态码: {response.status_code})")
             return True
         except requests.exceptions.RequestException as e:
             print(f"❌ 网络连接失败: {str(e)}")
             return False
 
-    def _query_first_step_from_flow(self, task_id: str) -> Optional[str]:
-        """通过 flowList 接口获取第一个步骤 ID（更可靠）"""
+    def _query_first_step_from_flow(
+        self, task_id: str, session: Optional[requests.Session] = None
+    ) -> Optional[str]:
+        """通过 flowList 接口获取第一个步骤 ID（更可靠）
+
+        可传入独立的 session 供后台线程使用；只请求一次不重试，失败时由调用方回退。
+        """
         url = f"{self.base_url}/teacher-course/abilityTrain/queryScriptStepFlowList"
         payload = {"trainTaskId": task_id}
 
         timeout = getattr(self, "base_timeout", 60)
         try:
-            response = self._post_json(url, payload, timeout=timeout)
-            result = response.json()
+            response = (session or self.session).post(
+                url, json=payload, headers=self.headers, timeout=timeout
+            )
+            result = self._parse_json(response)
 
             if result.get("code") == 200 and result.get("success"):
                 data = result.get("data") or []
@@ -528,9 +730,15 @@ class WorkflowTesterBase:
         print(f"请求URL: {url}")
 
         timeout = getattr(self, "base_timeout", 60)
+        # flowList only depends on task_id: fetch it alongside the step list
+        # instead of paying a third sequential round trip before run_card.
+        # requests.Session is not thread-safe, so the worker gets its own.
+        flow_session = requests.Session()
+        flow_pool = ThreadPoolExecutor(max_workers=1)
+        flow_future = flow_pool.submit(self._query_first_step_from_flow, task_id, flow_session)
         try:
             response = self._post_json(url, payload, timeout=timeout)
-            result = response.json()
+            result = self._parse_json(response)
 
             print(f"响应状态码: {response.status_code}")
 
@@ -550,8 +758,8 @@ class WorkflowTesterBase:
                     if self.step_name_mapping:
                         print(f"✅ 已加载 {len(self.step_name_mapping)} 个步骤名称映射")
 
-                # 优先通过 flowList 接口获取正确的第一个步骤
-                first_step_id = self._query_first_step_from_flow(task_id)
+                # 优先通过 flowList 接口获取正确的第一个步骤（已与步骤列表并行请求）
+                first_step_id = flow_future.result()
 
                 # 回退逻辑：如果 flowList 失败，使用原有方式
                 if not first_step_id:
@@ -568,6 +776,11 @@ class WorkflowTesterBase:
             raise Exception("请求超时")
         except requests.exceptions.RequestException as e:
             raise Exception(f"网络请求失败: {str(e)}")
+        finally:
+            # Never leave the worker running past this call
+            flow_future.cancel()
+            flow_pool.shutdown(wait=True)
+            flow_session.close()
 
     def run_card(self, task_id: str, step_id: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """Run a workflow card."""
@@ -576,17 +789,22 @@ class WorkflowTesterBase:
         if session_id:
             payload["sessionId"] = session_id
 
-        print(f"\n=== 运行卡片 (stepId: {step_id}) ===")
-        print(f"请求URL: {url}")
-        print(f"请求载荷: {json.dumps(payload, indent=2, ensure_ascii=False)}")
+        print(
+            f"\n=== 运行卡片 (stepId: {step_id}) ===\n"
+            f"请求URL: {url}\n"
+            f"请求载荷: {json.dumps(payload, indent=2, ensure_ascii=False)}"
+        )
 
         timeout = getattr(self, "base_timeout", 60)
         try:
-            response = self._post_json(url, payload, timeout=timeout)
-            result = response.json()
+            # runCard starts the step on the server: replaying it after a read
+            # timeout could start the step twice, so treat it like chat.
+            response = self._post_json(url, payload, timeout=timeout, idempotent=False)
+            result = self._parse_json(response)
             self._log_run_card(step_id, payload, result)
 
-            print(f"响应状态码: {response.status_code}")
+            # 本轮终端输出先收集，最后一次性打印
+            out = [f"响应状态码: {response.status_code}"]
 
             if result.get("code") == 200 and result.get("success"):
                 data = result.get("data") or {}
@@ -595,20 +813,23 @@ class WorkflowTesterBase:
 
                 self.question_text = data.get("text")
                 if self.question_text:
-                    print(f"\n📝 AI 说: {self.question_text}")
+                    out.append(f"\n📝 AI 说: {self.question_text}")
                     self._log_dialogue_entry(step_id, ai_text=self.question_text, source="runCard")
 
                 # 处理交互轮数为0的情况：needSkipStep=true 时自动跳到下一步
                 need_skip = data.get("needSkipStep", False)
                 next_step_id = data.get("nextStepId")
                 if need_skip and next_step_id:
-                    print(f"\n⏭️  当前步骤无需交互，自动跳转到下一步骤: {next_step_id}")
+                    out.append(f"\n⏭️  当前步骤无需交互，自动跳转到下一步骤: {next_step_id}")
+                    print("\n".join(out))
                     self.current_step_id = next_step_id
                     return self.run_card(task_id, next_step_id, self.session_id)
 
+                print("\n".join(out))
                 return result
 
-            print("训练完成")
+            out.append("训练完成")
+            print("\n".join(out))
             return result
 
         except requests.exceptions.Timeout:
@@ -629,15 +850,17 @@ class WorkflowTesterBase:
             "sessionId": self.session_id,
         }
 
-        print(f"\n=== 发送用户回答 ===")
-        print(f"👤 用户说: {user_input}")
+        print(f"\n=== 发送用户回答 ===\n👤 用户说: {user_input}")
 
         timeout = getattr(self, "base_timeout", 60)
+        self._pace_chat()
         try:
-            response = self._post_json(url, payload, timeout=timeout)
-            result = response.json()
+            # chat 不是幂等请求：读超时后重发可能重复提交回答，只在连接失败时重试
+            response = self._post_json(url, payload, timeout=timeout, idempotent=False)
+            result = self._parse_json(response)
 
-            print(f"响应状态码: {response.status_code}")
+            # 本轮终端输出先收集，最后一次性打印
+            out = [f"响应状态码: {response.status_code}"]
 
             if result.get("code") == 200 and result.get("success"):
                 data = result.get("data") or {}
@@ -650,17 +873,19 @@ class WorkflowTesterBase:
                 )
 
                 if ai_text:
-                    print(f"\n📝 AI 说: {ai_text}")
+                    out.append(f"\n📝 AI 说: {ai_text}")
                     self.question_text = ai_text
 
                 if need_skip and next_step_id:
-                    print(f"\n⏭️  需要跳转到下一步骤: {next_step_id}")
-                    print("自动调用 runCard...")
+                    out.append(f"\n⏭️  需要跳转到下一步骤: {next_step_id}\n自动调用 runCard...")
+                    print("\n".join(out))
                     self.current_step_id = next_step_id
                     return self.run_card(self.task_id, next_step_id, self.session_id)
 
+                print("\n".join(out))
                 return result
 
+            print("\n".join(out))
             raise Exception(f"发送消息失败: {result.get('msg')}")
 
         except requests.exceptions.Timeout:
@@ -684,6 +909,7 @@ class WorkflowTesterBase:
 
     def _finalize_workflow(self):
         """Optional finalize hook (e.g., write JSON logs)."""
+        self._close_logs()
         if hasattr(self, "_write_json_log") and getattr(self, "json_log_enabled", False):
             try:
                 self._write_json_log()
@@ -720,7 +946,6 @@ class WorkflowTesterBase:
                     break
 
                 round_num += 1
-                time.sleep(0.5)
 
             self._finalize_workflow()
 
@@ -741,7 +966,6 @@ class WorkflowTesterBase:
                     break
 
                 print(f"\n--- 第 {i} 轮对话 ---")
-                time.sleep(1)
 
                 result = self.chat(answer)
                 data = result.get("data") or {}